@@ -1,7 +1,12 @@
 # encoding: utf-8
+import errno
+import os
 import re
+import sqlite3
 
-from sqlalchemy import engine_from_config, orm
+from sqlalchemy import engine_from_config, event, exc, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 
 from ..defaults import get_default_db_uri
 from .tables import Language, metadata
@@ -10,12 +15,35 @@ from .multilang import MultilangSession, MultilangScopedSession
 ENGLISH_ID = 9
 
 
-def connect(uri=None, session_args={}, engine_args={}, engine_prefix=''):
+def connect(uri=None, session_args={}, engine_args={}, engine_prefix='', pool=None, readonly=False):
     """Connects to the requested URI.  Returns a session object.
 
     With the URI omitted, attempts to connect to a default SQLite database
     contained within the package directory.
 
+    `pool` is an optional dict of connection pool settings, for sharing one
+    database between many threads:
+
+    - `size`: Number of connections to keep open.
+    - `max_overflow`: Number of extra connections allowed under load.
+    - `timeout`: Seconds to wait for a free connection before giving up.
+    - `recycle`: Replace connections older than this many seconds.
+    - `pre_ping`: If true, check each connection with a trivial query when
+      it's taken from the pool, and replace it if it went stale.
+
+    If `readonly` is true, the database must be an existing SQLite file;
+    IOError is raised otherwise.  The file is treated as immutable: it's
+    memory-mapped, given a large page cache, and opened with `query_only`
+    set.  Where the sqlite3 module takes URI filenames, it's also opened as a
+    read-only `immutable=1` URI.  Python 2's sqlite3 can't do that, so there
+    `query_only` is what keeps the connection read-only.  The pool then
+    checks the process ID of every connection it hands out, so an engine
+    created before forking worker processes never shares a connection with
+    them.
+
+    No connection is opened until the session needs one.  Use the returned
+    session's `request_session` to get a session for one unit of work.
+
     Calling this function also binds the metadata object to the created engine.
     """
 
@@ -24,6 +52,7 @@ def connect(uri=None, session_args={}, engine_args={}, engine_prefix=''):
         uri = engine_args.get(engine_prefix + 'url', None)
     if uri is None:
         uri = get_default_db_uri()
+    engine_args = dict(engine_args)
 
     ### Do some fixery for MySQL
     if uri.startswith('mysql:'):
@@ -38,10 +67,37 @@ def connect(uri=None, session_args={}, engine_args={}, engine_prefix=''):
             table.kwargs['mysql_engine'] = 'InnoDB'
             table.kwargs['mysql_charset'] = 'utf8'
 
+    ### Pool settings
+    pool = dict(pool or {})
+    pre_ping = pool.pop('pre_ping', False)
+    for name, value in pool.items():
+        try:
+            arg = _pool_args[name]
+        except KeyError:
+            raise ValueError("Unknown pool setting: %s" % name)
+        engine_args[engine_prefix + arg] = value
+    if readonly:
+        url = make_url(uri)
+        if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+            raise ValueError("readonly only works with SQLite database files")
+        _check_sqlite_file(url.database)
+        engine_args[engine_prefix + 'creator'] = (
+            lambda: _connect_sqlite_readonly(url.database))
+    if (pool or readonly) and uri.startswith('sqlite:') and uri not in ('sqlite:', 'sqlite://'):
+        # SQLite files get a fresh connection for every checkout by default,
+        # which has nothing to configure; pool them like any other database
+        engine_args.setdefault(engine_prefix + 'poolclass', QueuePool)
+        engine_args.setdefault(engine_prefix + 'connect_args',
+            dict(check_same_thread=False))
+
     ### Connect
     engine_args[engine_prefix + 'url'] = uri
     engine = engine_from_config(engine_args, prefix=engine_prefix)
-    conn = engine.connect()
+    if pre_ping:
+        event.listen(engine, 'checkout', _ping_connection)
+    if readonly:
+        event.listen(engine, 'connect', _setup_readonly_connection)
+        event.listen(engine, 'checkout', _check_connection_pid)
     metadata.bind = engine
 
     all_session_args = dict(autoflush=True, autocommit=False, bind=engine)
@@ -52,6 +108,74 @@ def connect(uri=None, session_args={}, engine_args={}, engine_prefix=''):
 
     return session
 
+# connect()'s pool settings, and the engine arguments they stand for
+_pool_args = dict(
+    size='pool_size',
+    max_overflow='max_overflow',
+    timeout='pool_timeout',
+    recycle='pool_recycle',
+)
+
+def _ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Checks a connection as it's taken from the pool.  Raising
+    DisconnectionError makes the pool throw it away and try a new one.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+# Pragmas for read-only SQLite connections: memory-map up to 1GB of the file,
+# so forked workers share the OS page cache rather than each keeping copies,
+# and give each connection a 64MB page cache for whatever isn't mapped
+readonly_sqlite_pragmas = [
+    'PRAGMA mmap_size=1073741824',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA query_only=1',
+]
+
+def _check_sqlite_file(path):
+    """Raises IOError if there's no SQLite file at `path`.  Opening one
+    normally would create it, which a read-only connection mustn't do.
+    """
+    if not os.path.isfile(path):
+        raise IOError(errno.ENOENT, "No such database file", path)
+
+def _connect_sqlite_readonly(path):
+    """Opens a SQLite file read-only.  Python 2's sqlite3 can't take URI
+    filenames, so there it's opened normally, after making sure that won't
+    create the file, and only `query_only` keeps it read-only.
+    """
+    # urllib is slow to import, and this is the only place that needs it
+    import urllib
+    uri = 'file:%s?mode=ro&immutable=1' % urllib.quote(os.path.abspath(path))
+    try:
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    except TypeError:
+        _check_sqlite_file(path)
+        return sqlite3.connect(path, check_same_thread=False)
+
+def _setup_readonly_connection(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in readonly_sqlite_pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+def _check_connection_pid(dbapi_connection, connection_record, connection_proxy):
+    """Refuses connections that were opened in another process, i.e. before a
+    fork.  The pool then opens a new one for this process.
+    """
+    if connection_record.info.get('pid') != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection belongs to process %s" % connection_record.info.get('pid'))
+
 def identifier_from_name(name):
     """Make a string safe to use as an identifier.
 
@@ -52,3 +52,41 @@ def find_dependent_tables(tables, graph=None):
     dependents -= set(tables)
 
     return dependents
+
+def group_into_levels(tables, graph=None):
+    """Split the given tables into levels of the dependency graph.
+
+    Returns a list of lists of tables.  Tables in the first level don't depend
+    on any of the given tables; tables in each following level only depend on
+    tables in earlier levels.  Tables within a level can thus be loaded in any
+    order, or all at once.
+    """
+    if graph is None:
+        graph = _pokedex_graph
+    tables = list(tables)
+    table_set = set(tables)
+
+    # Count how many of the given tables each table is waiting for
+    waiting_for = dict((table, 0) for table in tables)
+    for table in tables:
+        for dependent_table in set(graph.get(table, [])):
+            if dependent_table in table_set and dependent_table is not table:
+                waiting_for[dependent_table] += 1
+
+    levels = []
+    current = [table for table in tables if not waiting_for[table]]
+    while current:
+        levels.append(sorted(current, key=lambda table: table.name))
+        next_level = []
+        for table in current:
+            for dependent_table in set(graph.get(table, [])):
+                if dependent_table in table_set and dependent_table is not table:
+                    waiting_for[dependent_table] -= 1
+                    if not waiting_for[dependent_table]:
+                        next_level.append(dependent_table)
+        current = next_level
+
+    if sum(len(level) for level in levels) != len(tables):
+        raise ValueError("Circular dependency between tables")
+
+    return levels
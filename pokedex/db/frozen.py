@@ -0,0 +1,492 @@
+# encoding: utf8
+u"""A frozen, in-memory copy of the whole database.
+
+The pokedex data doesn't change while it's being served, so instead of going
+through the ORM (and SQL) for every read, `freeze` reads every table once and
+returns a `FrozenDex` of lightweight, read-only records:
+
+    >>> dex = freeze(session)
+    >>> bulbasaur = dex.get(tables.PokemonSpecies, identifier=u'bulbasaur')
+    >>> bulbasaur.pokemon[0].types[0].name
+    u'Grass'
+
+There's one record class here for every mapped class in `pokedex.db.tables`,
+with the same name.  Records have `__slots__` for:
+
+- the table's columns, as plain values;
+- translated columns (`name`, `flavor_summary`...) in the dex's language, as
+  plain strings.  Markdown columns hold their Markdown source.  Missing
+  translations are None;
+- relationships that are a plain join on columns, possibly through one link
+  table, possibly with constant conditions: `Pokemon.species`,
+  `PokemonSpecies.pokemon`, `Pokemon.forms`, `Pokemon.types`,
+  `Pokemon.default_form`, `Move.type` and so on.  These hold a record (or
+  None), or a tuple of records in the relationship's order;
+- association proxies through one scalar relationship, to a column, a
+  translated column or another scalar relationship, like
+  `PokemonForm.species`.
+
+Anything else (relationships with other kinds of conditions, ordered by
+expressions, or onto translation tables; computed properties) isn't there;
+use the ORM for those.
+
+Nothing writes to a FrozenDex once it's built, so worker processes forked
+after `freeze` share it copy-on-write.  (CPython's reference counting still
+touches the pages of objects a worker uses, so some of them will be copied.)
+A FrozenDex can also be pickled; only the row data is stored, and the
+relationships are rebuilt on unpickling.  Single records can't be pickled on
+their own, since they refer to much of the rest of the dex.
+"""
+import gc
+from operator import attrgetter, itemgetter
+
+import sqlalchemy
+from sqlalchemy.ext.associationproxy import AssociationProxy
+from sqlalchemy.orm import class_mapper, configure_mappers
+from sqlalchemy.orm.properties import RelationshipProperty
+from sqlalchemy.schema import Column
+from sqlalchemy.sql import operators
+
+from pokedex.db import ENGLISH_ID, tables
+from pokedex.db.multilang import LocalAssociationProxy
+
+__all__ = ['freeze', 'FrozenDex', 'Record']
+
+class Record(object):
+    """Base class for frozen records.  Attributes can't be set or deleted."""
+    __slots__ = ()
+
+    #: The class in `pokedex.db.tables` this is a frozen copy of
+    mapped_class = None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s records are read-only" % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s records are read-only" % type(self).__name__)
+
+    def __reduce__(self):
+        raise TypeError("Frozen records can't be pickled on their own; "
+            "pickle the FrozenDex instead")
+
+    def __unicode__(self):
+        typename = u'.'.join((__name__, type(self).__name__))
+        pk = u', '.join(unicode(getattr(self, column.name))
+            for column in self.mapped_class.__table__.primary_key.columns)
+        try:
+            return u"<%s record (%s): %s>" % (typename, pk, self.identifier)
+        except AttributeError:
+            return u"<%s record (%s)>" % (typename, pk)
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __repr__(self):
+        return unicode(self).encode('utf8')
+
+_set = object.__setattr__
+
+def _key_getter(columns):
+    """Returns a function that gets the values of `columns` from a record.
+    That's a tuple for several columns, and the value itself for one.
+    """
+    return attrgetter(*[column.name for column in columns])
+
+
+### Working out what each record class holds
+
+def _split_condition(clause):
+    """Splits a join condition into (column, column) equalities and
+    (column, value) conditions.  Returns None if it has anything else in it.
+    """
+    if getattr(clause, 'operator', None) is operators.and_:
+        clauses = clause.clauses
+    else:
+        clauses = [clause]
+    pairs = []
+    conditions = []
+    for clause in clauses:
+        if getattr(clause, 'operator', None) is not operators.eq:
+            return None
+        left, right = clause.left, clause.right
+        if isinstance(left, Column) and isinstance(right, Column):
+            pairs.append((left, right))
+        elif isinstance(left, Column) and hasattr(right, 'value'):
+            conditions.append((left, right.value))
+        else:
+            return None
+    return pairs, conditions
+
+def _split_order_by(order_by):
+    """Returns a list of (column, descending?) for a relationship's order_by,
+    or None if it orders by anything but plain columns.
+    """
+    if not order_by:
+        return []
+    result = []
+    for clause in order_by:
+        if isinstance(clause, Column):
+            result.append((clause, False))
+        elif (isinstance(getattr(clause, 'element', None), Column) and
+                getattr(clause, 'modifier', None) in (operators.asc_op, operators.desc_op)):
+            result.append((clause.element, clause.modifier is operators.desc_op))
+        else:
+            return None
+    return result
+
+class _Relationship(object):
+    """How to fill in one relationship attribute of a record class.
+
+    `local` are the columns of the record's own table that are joined on.
+    `link` is None for a direct join, and otherwise (link class, columns of
+    the link table matching `local`, columns of the link table joined to the
+    target).  `remote` are the target's columns that are joined on.
+    `conditions` are (column, value) pairs that the link or target rows must
+    also match, and `order_by` is a list of (column, descending?).
+    """
+    def __init__(self, name, target, local, link, remote, conditions,
+            order_by, uselist):
+        self.name = name
+        self.target = target
+        self.local = local
+        self.link = link
+        self.remote = remote
+        self.conditions = conditions
+        self.order_by = order_by
+        self.uselist = uselist
+
+def _relationship(name, prop, classes_by_table):
+    """Returns a _Relationship for the given RelationshipProperty, or None if
+    it can't be frozen.
+    """
+    target = prop.mapper.class_
+    if target.__table__ not in classes_by_table:
+        return None
+    order_by = _split_order_by(prop.order_by)
+    if order_by is None:
+        return None
+
+    if prop.secondary is None:
+        split = _split_condition(prop.primaryjoin)
+        if split is None:
+            return None
+        pairs, conditions = split
+        local_remote = list(prop.local_remote_pairs)
+        if len(local_remote) != len(pairs):
+            return None
+        if any(column.table is not target.__table__ for column, value in conditions):
+            return None
+        return _Relationship(name, target,
+            local=[local for local, remote in local_remote], link=None,
+            remote=[remote for local, remote in local_remote],
+            conditions=conditions, order_by=order_by, uselist=prop.uselist)
+
+    link_class = classes_by_table.get(prop.secondary)
+    primary = _split_condition(prop.primaryjoin)
+    secondary = _split_condition(prop.secondaryjoin)
+    if link_class is None or primary is None or secondary is None:
+        return None
+    own_table = prop.parent.local_table
+    local, link_local = _orient(primary[0], own_table, prop.secondary)
+    link_remote, remote = _orient(secondary[0], prop.secondary, target.__table__)
+    if local is None or link_remote is None:
+        return None
+    return _Relationship(name, target, local=local,
+        link=(link_class, link_local, link_remote), remote=remote,
+        conditions=primary[1] + secondary[1], order_by=order_by,
+        uselist=prop.uselist)
+
+def _orient(pairs, left_table, right_table):
+    """Sorts (column, column) pairs into a list of `left_table` columns and a
+    list of the matching `right_table` columns.
+    """
+    lefts = []
+    rights = []
+    for a, b in pairs:
+        if a.table is right_table and b.table is left_table:
+            a, b = b, a
+        if a.table is not left_table or b.table is not right_table:
+            return None, None
+        lefts.append(a)
+        rights.append(b)
+    return lefts, rights
+
+def _plain_attributes(cls):
+    """Names of a mapped class's columns and translated columns."""
+    names = set(cls.__table__.c.keys())
+    for translation_class in cls.translation_classes:
+        names.update(translation_class.__table__.c.keys())
+    return names
+
+def _relationships(cls, classes_by_table):
+    """Returns a dict of the mapped class's relationships that can be frozen,
+    as _Relationship objects by name.
+    """
+    names = _plain_attributes(cls)
+    relationships = {}
+    for prop in class_mapper(cls).iterate_properties:
+        if isinstance(prop, RelationshipProperty) and prop.key not in names:
+            relationship = _relationship(prop.key, prop, classes_by_table)
+            if relationship is not None:
+                relationships[prop.key] = relationship
+    return relationships
+
+def _make_record_class(cls, relationships_by_class):
+    table = cls.__table__
+    columns = tuple(column.name for column in table.columns)
+
+    translated = []
+    translation_tables = []
+    for translation_class in cls.translation_classes:
+        translation_table = translation_class.__table__
+        foreign_key = cls.__singlename__ + '_id'
+        names = tuple(column.name for column in translation_table.columns
+            if column.name not in (foreign_key, 'local_language_id')
+            and column.name not in columns and column.name not in translated)
+        translated.extend(names)
+        translation_tables.append((translation_table, foreign_key, names))
+
+    fields = columns + tuple(translated)
+    relationships = relationships_by_class[cls]
+    names = set(fields)
+    names.update(relationships)
+
+    # Proxies go through one scalar relationship, to a plain attribute or a
+    # scalar relationship of the target
+    proxies = {}
+    for klass in cls.__mro__:
+        for name, value in vars(klass).items():
+            if (not isinstance(value, AssociationProxy) or
+                    isinstance(value, LocalAssociationProxy) or
+                    name in names):
+                continue
+            relationship = relationships.get(value.target_collection)
+            if relationship is None or relationship.uselist:
+                continue
+            target_relationship = relationships_by_class[
+                relationship.target].get(value.value_attr)
+            if (value.value_attr in _plain_attributes(relationship.target) or
+                    (target_relationship is not None and
+                        not target_relationship.uselist)):
+                proxies[name] = value.target_collection, value.value_attr
+
+    return type(cls.__name__, (Record,), dict(
+        __slots__=fields + tuple(sorted(relationships)) + tuple(sorted(proxies)),
+        __module__=__name__,
+        __doc__="Frozen copy of `pokedex.db.tables.%s`" % cls.__name__,
+        mapped_class=cls,
+        _fields=fields,
+        _columns=columns,
+        _translation_tables=tuple(translation_tables),
+        _relationships=tuple(relationships.values()),
+        _proxies=tuple((name, target, attr)
+            for name, (target, attr) in proxies.items()),
+    ))
+
+configure_mappers()
+_classes_by_table = dict((cls.__table__, cls) for cls in tables.mapped_classes)
+_relationships_by_class = dict((cls, _relationships(cls, _classes_by_table))
+    for cls in tables.mapped_classes)
+_record_classes = {}
+for _cls in tables.mapped_classes:
+    _record_classes[_cls] = globals()[_cls.__name__] = _make_record_class(
+        _cls, _relationships_by_class)
+    __all__.append(_cls.__name__)
+del _cls
+
+
+### The dex itself
+
+def freeze(session, language_id=ENGLISH_ID):
+    """Reads the whole database through `session` into a new FrozenDex.
+
+    Translated columns are taken in the language with the given ID; English
+    by default.
+    """
+    data = {}
+    for cls, record_class in _record_classes.items():
+        table = cls.__table__
+        rows = session.execute(sqlalchemy.select([table],
+            order_by=list(table.primary_key.columns))).fetchall()
+
+        translations = {}
+        for translation_table, foreign_key, names in record_class._translation_tables:
+            columns = [translation_table.c[name] for name in names]
+            query = sqlalchemy.select([translation_table.c[foreign_key]] + columns,
+                translation_table.c.local_language_id == language_id)
+            for row in session.execute(query):
+                translations.setdefault(row[0], {}).update(zip(names, row[1:]))
+
+        translated_names = record_class._fields[len(record_class._columns):]
+        if translated_names:
+            id_index = record_class._columns.index('id')
+            data[cls.__name__] = [tuple(row) + tuple(
+                    translations.get(row[id_index], {}).get(name)
+                    for name in translated_names)
+                for row in rows]
+        else:
+            data[cls.__name__] = [tuple(row) for row in rows]
+    return FrozenDex(language_id, data)
+
+class FrozenDex(object):
+    """A read-only, in-memory copy of the database; see the module docs.
+
+    Made by `freeze`.  Tables are given as either the mapped classes from
+    `pokedex.db.tables` or the record classes from this module.
+    """
+    def __init__(self, language_id, data):
+        """`data` maps each mapped class's name to a list of its rows, in
+        primary key order.  Each row is a tuple of the class's column values,
+        followed by its translated values.
+        """
+        # Building the dex makes millions of objects, and none of them are
+        # garbage; the cyclic collector would keep rescanning them all for
+        # nothing
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._build(language_id, data)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _build(self, language_id, data):
+        self.language_id = language_id
+
+        self._records = {}
+        for cls, record_class in _record_classes.items():
+            new = record_class.__new__
+            fields = record_class._fields
+            records = []
+            for values in data.get(cls.__name__, ()):
+                record = new(record_class)
+                for name, value in zip(fields, values):
+                    _set(record, name, value)
+                records.append(record)
+            self._records[cls] = tuple(records)
+
+        # Indexes are only needed while linking the records up
+        indexes = {}
+        for cls, record_class in _record_classes.items():
+            for relationship in record_class._relationships:
+                self._link(self._records[cls], relationship, indexes)
+        del indexes
+        # Proxies can go through relationships, so they come after all links
+        for cls, record_class in _record_classes.items():
+            for name, target, attr in record_class._proxies:
+                for record in self._records[cls]:
+                    value = getattr(record, target)
+                    if value is not None:
+                        value = getattr(value, attr)
+                    _set(record, name, value)
+
+        self._by_id = {}
+        self._by_identifier = {}
+        for cls, records in self._records.items():
+            if list(cls.__table__.primary_key.columns.keys()) == ['id']:
+                self._by_id[cls] = dict((r.id, r) for r in records)
+            if 'identifier' in cls.__table__.c:
+                by_identifier = self._by_identifier[cls] = {}
+                for record in records:
+                    by_identifier.setdefault(record.identifier, []).append(record)
+
+    def _index(self, indexes, cls, columns, conditions):
+        """Returns a dict of the records of `cls` that match `conditions`, by
+        the values of `columns` (see `_key_getter`).  Indexes are cached in
+        `indexes`.
+        """
+        key = cls, tuple(columns), tuple(conditions)
+        try:
+            return indexes[key]
+        except KeyError:
+            pass
+        records = self._records[cls]
+        for column, value in conditions:
+            if column.table is cls.__table__:
+                get = attrgetter(column.name)
+                records = [record for record in records if get(record) == value]
+        index = indexes[key] = {}
+        for values, record in zip(map(_key_getter(columns), records), records):
+            index.setdefault(values, []).append(record)
+        return index
+
+    def _link(self, records, relationship, indexes):
+        """Fills in one relationship attribute on every record of a class.
+
+        The related records are found and sorted once per distinct key, and
+        records with the same key share the result.
+        """
+        target_index = self._index(indexes, relationship.target,
+            relationship.remote, relationship.conditions)
+        if relationship.link is None:
+            # (link, target) pairs, with no link
+            found_by_key = dict((key, [(None, target) for target in targets])
+                for key, targets in target_index.iteritems())
+        else:
+            link_class, link_local, link_remote = relationship.link
+            link_index = self._index(indexes, link_class, link_local,
+                relationship.conditions)
+            link_key = _key_getter(link_remote)
+            found_by_key = dict((key, [(link, target)
+                        for link in links
+                        for target in target_index.get(link_key(link), ())])
+                for key, links in link_index.iteritems())
+
+        # Sort by each key in turn, last one first; sorts are stable
+        sorts = [(itemgetter(1 if column.table is relationship.target.__table__
+                    else 0), attrgetter(column.name), descending)
+            for column, descending in reversed(relationship.order_by)]
+        targets_by_key = {}
+        for key, found in found_by_key.iteritems():
+            for get_record, get_value, descending in sorts:
+                found.sort(key=lambda pair: get_value(get_record(pair)),
+                    reverse=descending)
+            targets = tuple(target for link, target in found)
+            if relationship.uselist:
+                targets_by_key[key] = targets
+            elif targets:
+                targets_by_key[key] = targets[0]
+
+        local_key = _key_getter(relationship.local)
+        name = relationship.name
+        empty = () if relationship.uselist else None
+        get_targets = targets_by_key.get
+        for record in records:
+            _set(record, name, get_targets(local_key(record), empty))
+
+    def __reduce__(self):
+        data = dict((cls.__name__, [
+                    tuple(getattr(record, name) for name in record._fields)
+                    for record in records])
+            for cls, records in self._records.items())
+        return FrozenDex, (self.language_id, data)
+
+    def _mapped_class(self, table):
+        return getattr(table, 'mapped_class', None) or table
+
+    def all(self, table):
+        """Returns a tuple of all the records of a table, in primary key
+        order.
+        """
+        return self._records[self._mapped_class(table)]
+
+    def get(self, table, identifier=None, id=None):
+        """Returns one record by id or identifier, like `pokedex.db.util.get`.
+
+        Raises KeyError if there's no such record, and ValueError if the
+        identifier is ambiguous.
+        """
+        cls = self._mapped_class(table)
+        if id is not None:
+            record = self._by_id[cls][id]
+            if identifier is not None and record.identifier != identifier:
+                raise KeyError(identifier)
+            return record
+        elif identifier is not None:
+            records = self._by_identifier[cls][identifier]
+            if len(records) > 1:
+                raise ValueError("%s identifier %s is ambiguous" % (
+                    cls.__name__, identifier))
+            return records[0]
+        else:
+            raise TypeError("get() needs an identifier or id")
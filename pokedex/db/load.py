@@ -1,19 +1,136 @@
 """CSV to database or vice versa."""
 import csv
 import fnmatch
+from contextlib import closing
+import hashlib
+import io
+import itertools
 import os.path
+import Queue
+import sqlite3
 import sys
+import threading
+import time
 
+import sqlalchemy
 import sqlalchemy.sql.util
 import sqlalchemy.types
+from sqlalchemy import Column, ForeignKeyConstraint, Integer, MetaData, Table, Unicode
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from sqlalchemy.orm import Session
 
 import pokedex
-from pokedex.db import metadata, tables, translations
-from pokedex.defaults import get_default_csv_dir
-from pokedex.db.dependencies import find_dependent_tables
+from pokedex.db import metadata, tables, translations, workers
+from pokedex.defaults import default_batch_size, get_default_csv_dir
+from pokedex.db.dependencies import find_dependent_tables, group_into_levels
+from pokedex.db.source import DirectorySource, open_source
+from pokedex.db.verify import verify
+from pokedex.timing import Profile, TableTiming
+
+
+#: Records the CSV file each table was last loaded from, so that incremental
+#: loads know what changed.  This isn't part of the pokedex schema proper, so
+#: it lives in its own metadata.
+manifest_metadata = MetaData()
+manifest_table = Table('pokedex_load_manifest', manifest_metadata,
+    Column('table_name', Unicode(64), primary_key=True, nullable=False),
+    Column('csv_hash', Unicode(40), nullable=False),
+    Column('row_count', Integer, nullable=False),
+)
+
+# Manifest entry for the translations/*.csv files as a whole
+_translations_manifest_key = u'translations'
+
+def _hash_file(source, filename, hasher):
+    with closing(source.open(filename)) as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            hasher.update(chunk)
+
+def _hash_csv(source, filename):
+    """Returns the SHA-1 hex digest of a CSV file's contents, or None if it's
+    missing.
+
+    Compressed files are hashed as uncompressed, so recompressing a file
+    doesn't count as changing it.
+    """
+    hasher = hashlib.sha1()
+    try:
+        _hash_file(source, filename, hasher)
+    except IOError:
+        return None
+    return unicode(hasher.hexdigest())
+
+def _hash_translations(source, langs):
+    """Returns a SHA-1 hex digest covering the translation CSV files that a
+    load with the given `langs` would use.
+    """
+    if langs is None:
+        try:
+            filenames = sorted(fnmatch.filter(
+                source.listdir('translations'), '*.csv'))
+        except OSError:
+            filenames = []
+    else:
+        filenames = sorted('%s.csv' % lang for lang in langs)
 
+    hasher = hashlib.sha1()
+    hasher.update(repr(None if langs is None else sorted(langs)))
+    for filename in filenames:
+        hasher.update(filename)
+        try:
+            _hash_file(source, 'translations/' + filename, hasher)
+        except IOError:
+            pass
+    return unicode(hasher.hexdigest())
 
-def _get_table_names(metadata, patterns):
+def csv_manifest_hash(directory=None, langs=None):
+    """Returns a SHA-1 hex digest identifying all the CSV data that a full
+    load from `directory` (a CSV directory or archive; see
+    `pokedex.db.source`) with the given `langs` would use.
+
+    This combines the same per-file hashes the manifest table records.
+    """
+    if directory is None:
+        directory = get_default_csv_dir()
+    source = open_source(directory)
+
+    hasher = hashlib.sha1()
+    for table_name in sorted(metadata.tables):
+        csv_hash = _hash_csv(source, table_name + '.csv')
+        hasher.update('%s %s\n' % (table_name, csv_hash))
+    hasher.update('%s %s\n' % (_translations_manifest_key,
+        _hash_translations(source, langs)))
+    return unicode(hasher.hexdigest())
+
+def _create_bare_table(table, bind, foreign_keys=True):
+    """Creates the given table without its indexes, and without its foreign
+    key constraints unless `foreign_keys` is set.
+
+    Returns a list of DDL elements that add the missing pieces.
+    """
+    indexes = table.indexes
+    deferred_constraints = []
+    if not foreign_keys:
+        deferred_constraints = [constraint for constraint in table.constraints
+            if isinstance(constraint, ForeignKeyConstraint)
+            and not constraint.use_alter]
+
+    # CreateTable leaves out use_alter constraints; the indexes are created
+    # separately by table.create().  Hide both for the moment.
+    table.indexes = set()
+    for constraint in deferred_constraints:
+        constraint.use_alter = True
+    try:
+        table.create(bind=bind)
+    finally:
+        table.indexes = indexes
+        for constraint in deferred_constraints:
+            constraint.use_alter = False
+
+    return ([CreateIndex(index) for index in sorted(indexes, key=lambda i: i.name)] +
+        [AddConstraint(constraint) for constraint in deferred_constraints])
+
+def get_table_names(metadata, patterns):
     """Returns a list of table names from the given metadata.  If `patterns`
     exists, only tables matching one of the patterns will be returned.
     """
@@ -32,7 +149,7 @@ def _get_table_names(metadata, patterns):
 
     return list(table_names)
 
-def _get_verbose_prints(verbose):
+def get_verbose_prints(verbose):
     """If `verbose` is true, returns three functions: one for printing a
     starting message, one for printing an interim status update, and one for
     printing a success or failure message when finished.
@@ -95,7 +212,384 @@ def _get_verbose_prints(verbose):
     return print_start, print_status, print_done
 
 
-def load(session, tables=[], directory=None, drop_tables=False, verbose=False, safe=True, recursive=True, langs=None):
+def _prefetch(iterable, size=10000):
+    """Run the given iterable in a background thread, `size` items ahead.
+
+    Returns an iterator over the same items.  Exceptions raised by the
+    iterable are re-raised in the consuming thread.  Closing the iterator
+    (or dropping it) stops the thread.
+    """
+    queue = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                queue.put((item, None))
+        except Exception:
+            queue.put((done, sys.exc_info()))
+        else:
+            queue.put((done, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        # If the consumer gave up early, the producer may be stuck on a full
+        # queue; make room so it can notice it should stop
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        thread.join()
+    if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+def _decode(value):
+    return value.decode('utf-8')
+
+def _decode_or_null(value):
+    # Empty string in a nullable column really means NULL
+    if value == '':
+        return None
+    return value.decode('utf-8')
+
+def _boolean(value):
+    # Boolean values are stored as string values 0/1, but both of those
+    # evaluate as true; SQLA wants True/False
+    return value != '0'
+
+def _boolean_or_null(value):
+    if value == '':
+        return None
+    return value != '0'
+
+def _make_converters(table_obj, column_names, dialect):
+    """Returns a tuple of functions, one per CSV column, that turn a CSV
+    value into a parameter ready to be handed to the DB-API.
+
+    Doing all the column lookups once per table, rather than once per cell,
+    saves a lot of time on the big tables.
+    """
+    converters = []
+    for column_name in column_names:
+        column = table_obj.c[column_name]
+        if isinstance(column.type, sqlalchemy.types.Boolean):
+            if column.nullable:
+                convert = _boolean_or_null
+            else:
+                convert = _boolean
+        else:
+            # Otherwise, unflatten from bytes
+            if column.nullable:
+                convert = _decode_or_null
+            else:
+                convert = _decode
+
+        # Since the rows skip SQLA's own parameter processing, apply the
+        # dialect's bind processor here, if the type has one
+        process = column.type.dialect_impl(dialect).bind_processor(dialect)
+        if process is not None:
+            convert = (lambda convert, process:
+                lambda value: process(convert(value)))(convert, process)
+
+        converters.append(convert)
+    return tuple(converters)
+
+def _read_rows(converters, reader):
+    """Yield rows from a CSV reader as tuples of DB-API parameters."""
+    for csvs in reader:
+        yield tuple([convert(value) for convert, value in zip(converters, csvs)])
+
+# How much of a CSV file to send to PostgreSQL's COPY at a time
+_copy_chunk_size = 64 * 1024
+
+class _RecordCounter(object):
+    """Wraps a CSV file, counting the records (including the header) read
+    through it.  COPY's rowcount isn't reliable, so this is used instead.
+
+    Newlines in quoted values don't end a record.  Doubled quotes inside a
+    value flip the quoting twice, so just counting quotes is enough.
+    """
+    def __init__(self, csvfile):
+        self.csvfile = csvfile
+        self.newlines = 0
+        self.quoted = False
+        self.last = '\n'
+
+    def read(self, size=-1):
+        data = self.csvfile.read(size)
+        if data:
+            parts = data.split('"')
+            # Every other part is outside the quotes
+            self.newlines += sum(part.count('\n')
+                for part in parts[int(self.quoted)::2])
+            self.quoted ^= len(parts) % 2 == 0
+            self.last = data[-1]
+        return data
+
+    @property
+    def records(self):
+        # The last line may not end with a newline
+        return self.newlines + (self.last != '\n')
+
+# DB-API placeholders that take parameters by position
+_positional_placeholders = dict(qmark='?', format='%s', pyformat='%s')
+
+def _make_insert(table_obj, column_names, dialect):
+    """Returns a function that inserts a list of positional parameter tuples,
+    as made by _read_rows, through the given connection.
+    """
+    if dialect.paramstyle in _positional_placeholders or dialect.paramstyle == 'numeric':
+        preparer = dialect.identifier_preparer
+        if dialect.paramstyle == 'numeric':
+            placeholders = [':%d' % (n + 1) for n in range(len(column_names))]
+        else:
+            placeholders = [_positional_placeholders[dialect.paramstyle]] * len(column_names)
+        statement = "INSERT INTO %s (%s) VALUES (%s)" % (
+            preparer.format_table(table_obj),
+            ', '.join(preparer.format_column(table_obj.c[name])
+                for name in column_names),
+            ', '.join(placeholders),
+        )
+
+        def insert(connection, rows):
+            connection.execute(statement, rows)
+    else:
+        # Named parameters only; this needs dicts after all
+        insert_stmt = table_obj.insert()
+        keys = [str(name) for name in column_names]
+
+        def insert(connection, rows):
+            connection.execute(insert_stmt, [dict(zip(keys, row)) for row in rows])
+
+    return insert
+
+def _sort_self_referencing(rows, id_index, ref_indices):
+    """Sort rows of a self-referential table so that each row comes after any
+    rows it refers to, through the columns at `ref_indices`.
+
+    Chains of any depth are fine.  Otherwise, the original order is kept as
+    far as possible.
+    """
+    ids = set(row[id_index] for row in rows)
+    placed_ids = set()
+    sorted_rows = []
+    while rows:
+        # Take every row whose references are all already placed (or NULL,
+        # or itself, or outside this table)
+        ready = []
+        waiting = []
+        for row in rows:
+            for index in ref_indices:
+                foreign_id = row[index]
+                if (foreign_id in ids and foreign_id not in placed_ids
+                        and foreign_id != row[id_index]):
+                    waiting.append(row)
+                    break
+            else:
+                ready.append(row)
+
+        if not ready:
+            raise ValueError("Circular self-reference!  "
+                             "Rows were: " + str(waiting))
+
+        sorted_rows.extend(ready)
+        placed_ids.update(row[id_index] for row in ready)
+        rows = waiting
+
+    return sorted_rows
+
+def _tell(csvfile):
+    """Returns how far into the file the CSV reader is, as far as that can be
+    told; some decompressing file objects can't.
+    """
+    try:
+        return csvfile.tell()
+    except (AttributeError, IOError, io.UnsupportedOperation):
+        return 0
+
+# How many batches the CSV parser may get ahead of the inserts
+_pipeline_depth = 8
+
+def _load_table(session, table_obj, source, safe=True, print_status=None,
+                pipeline=False, batch_size=default_batch_size, timing=None):
+    """Load a single table from its CSV file in the given source (see
+    `pokedex.db.source`), committing as it goes.
+
+    Returns the number of rows loaded, or None if there is no CSV file.
+
+    Rows are inserted `batch_size` at a time.  If `pipeline` is set, the CSV
+    is parsed into batches in a separate thread while earlier batches are
+    being inserted.
+
+    If a `TableTiming` is given as `timing`, it's filled in as the table is
+    loaded.
+    """
+    if print_status is None:
+        print_status = lambda msg: None
+    if timing is None:
+        timing = TableTiming(table_obj.name)
+
+    table_name = table_obj.name
+
+    csvname = table_name + '.csv'
+    try:
+        csvfile = source.open(csvname)
+    except IOError:
+        # File doesn't exist; don't load anything!
+        return None
+
+    csvsize = source.size(csvname)
+    timing.bytes = csvsize or 0
+
+    reader = csv.reader(csvfile, lineterminator='\n')
+    column_names = [unicode(column) for column in reader.next()]
+
+    dialect = session.connection().dialect
+    if not safe and dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        """
+        Postgres' CSV dialect works with our data, if we mark the not-null
+        columns with FORCE NOT NULL.
+        The file is streamed over the connection with COPY ... FROM STDIN,
+        so this doesn't need superuser rights, and the CSV doesn't have to
+        be on the database server.
+        Self-referential rows may come in any order: the whole file is one
+        statement, and foreign keys are only checked at its end.
+        """
+        session.commit()
+        not_null_cols = [c for c in column_names if not table_obj.c[c].nullable]
+        if not_null_cols:
+            force_not_null = 'FORCE NOT NULL ' + ','.join('"%s"' % c for c in not_null_cols)
+        else:
+            force_not_null = ''
+        command = "COPY %(table_name)s (%(columns)s) FROM STDIN CSV HEADER %(force_not_null)s"
+        cursor = session.connection().connection.cursor()
+        # Not every source can seek; just start over
+        csvfile.close()
+        csvfile = source.open(csvname)
+        counter = _RecordCounter(csvfile)
+        try:
+            # The server does the parsing, so it all counts as inserting
+            with timing.phase('insert'):
+                cursor.copy_expert(
+                    command % dict(
+                        table_name=table_name,
+                        columns=','.join('"%s"' % c for c in column_names),
+                        force_not_null=force_not_null,
+                    ),
+                    counter,
+                    size=_copy_chunk_size,
+                )
+                session.commit()
+        finally:
+            cursor.close()
+            csvfile.close()
+        # Not counting the header
+        row_count = counter.records - 1
+        timing.commits += 1
+        timing.rows = row_count
+        return row_count
+
+    converters = _make_converters(table_obj, column_names, dialect)
+    insert = _make_insert(table_obj, column_names, dialect)
+
+    # Fetch positions of foreign key columns that point at this table, if any
+    self_ref_indices = []
+    for index, column_name in enumerate(column_names):
+        column = table_obj.c[column_name]
+        if any(x.references(table_obj) for x in column.foreign_keys):
+            self_ref_indices.append(index)
+
+    def parse():
+        rows = _read_rows(converters, reader)
+
+        if self_ref_indices:
+            # Self-referential tables may contain rows with foreign keys of
+            # other rows in the same table that come later in the file.  Such
+            # tables are small, so sort them in memory so that every row
+            # comes after the rows it refers to, and insert them all in one
+            # transaction.
+            # ASSUMPTION: Self-referential tables have a single PK called "id"
+            rows = iter(_sort_self_referencing(list(rows),
+                column_names.index('id'), self_ref_indices))
+
+        # Remembering some zillion rows consumes a lot of RAM.  Let's not do
+        # that.  Insert a batch at a time.
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            yield batch
+
+    batches = parse()
+    if pipeline:
+        # The parser only gets so far ahead, so memory use stays bounded
+        batches = _prefetch(batches, size=_pipeline_depth)
+
+    # Timing whole batches, rather than single rows, keeps the clock calls
+    # out of the way.  When pipelining, "parse" is the time spent waiting
+    # for the parser.
+    row_count = 0
+    try:
+        while True:
+            start = time.time()
+            new_rows = next(batches, None)
+            timing.add_time('parse', time.time() - start)
+            if new_rows is None:
+                break
+
+            start = time.time()
+            insert(session.connection(), new_rows)
+            if not self_ref_indices:
+                session.commit()
+                timing.commits += 1
+            timing.add_time('insert', time.time() - start)
+            row_count += len(new_rows)
+
+            if csvsize:
+                print_status("%d%%" % (100 * _tell(csvfile) // csvsize))
+    finally:
+        # Stops the parser thread, if the inserts failed
+        batches.close()
+        csvfile.close()
+
+    with timing.phase('insert'):
+        session.commit()
+    timing.commits += 1
+    timing.rows = row_count
+
+    return row_count
+
+def _load_table_in_worker(args):
+    """Load one table in a worker process; see `load`."""
+    table_name, directory, safe, batch_size, pipeline = args
+    # Time it here; the parent only sees when the result arrives
+    profile = Profile('load')
+    try:
+        with profile.table(table_name) as timing:
+            result = _load_table(workers.session,
+                metadata.tables[table_name], workers.get_source(directory),
+                safe=safe,
+                batch_size=batch_size, pipeline=pipeline, timing=timing)
+    except Exception:
+        workers.session.rollback()
+        raise
+    return table_name, result, timing
+
+def load(session, tables=[], directory=None, drop_tables=False, verbose=False, safe=True, recursive=True, langs=None, jobs=1, incremental=False, profile=None, batch_size=default_batch_size, pipeline=True, check_foreign_keys=True):
     """Load data from CSV files into the given database session.
 
     Tables are created automatically.
@@ -108,7 +602,8 @@ def load(session, tables=[], directory=None, drop_tables=False, verbose=False, s
 
     `directory`
         Directory the CSV files reside in.  Defaults to the `pokedex` data
-        directory.
+        directory.  This can also be a zip file or tarball of the CSV files,
+        or a directory of gzipped CSV files; see `pokedex.db.source`.
 
     `drop_tables`
         If set to True, existing `pokedex`-related tables will be dropped.
@@ -118,31 +613,115 @@ def load(session, tables=[], directory=None, drop_tables=False, verbose=False, s
 
     `safe`
         If set to False, load can be faster, but can corrupt the database if
-        it crashes or is interrupted.
+        it crashes or is interrupted.  Indexes (and on PostgreSQL, foreign
+        keys) are then only created after all the data is loaded.
 
     `recursive`
         If set to True, load all dependent tables too.
 
     `langs`
         List of identifiers of extra language to load, or None to load them all
+
+    `jobs`
+        Number of tables to load at once.  Tables are grouped into levels of
+        the foreign key graph, and each level is loaded by several worker
+        processes.  SQLite can only take one writer, so there this is
+        ignored; see `pipeline` for parsing in the background instead.
+
+    `incremental`
+        If set to True, only load tables whose CSV files changed since they
+        were last loaded, according to the manifest table, plus the tables
+        that depend on them.  Those tables are dropped first.
+
+    `profile`
+        A `pokedex.timing.Profile` to record per-table timings in.
+
+    `batch_size`
+        Number of rows to insert (and, for most tables, commit) at a time.
+
+    `pipeline`
+        If set to True, each CSV file is parsed in a separate thread, a few
+        batches ahead of the inserts.  This mostly helps on networked
+        databases, where the round trips can overlap with the parsing.
+
+    `check_foreign_keys`
+        If set to True, check that every foreign key of the loaded tables
+        refers to an existing row once everything is loaded.  See
+        `pokedex.db.verify`.
+
+    Returns a list of (foreign key description, orphan count) for the
+    foreign keys with rows that refer to nothing, as `verify` does.  It's
+    empty if all is well, or if foreign keys weren't checked.
     """
 
     # First take care of verbosity
-    print_start, print_status, print_done = _get_verbose_prints(verbose)
+    print_start, print_status, print_done = get_verbose_prints(verbose)
 
+    if profile is None:
+        profile = Profile('load')
 
     if directory is None:
         directory = get_default_csv_dir()
+    source = open_source(directory)
 
     # XXX why isn't this done in command_load
-    table_names = _get_table_names(metadata, tables)
+    table_names = get_table_names(metadata, tables)
     table_objs = [metadata.tables[name] for name in table_names]
 
     if recursive:
         table_objs.extend(find_dependent_tables(table_objs))
 
+    # Find out what has already been loaded
+    bind = session.get_bind()
+    manifest_table.create(bind=bind, checkfirst=True)
+    manifest = dict(session.execute(sqlalchemy.select([
+            manifest_table.c.table_name, manifest_table.c.csv_hash])).fetchall())
+
+    csv_hashes = {}
+    def get_csv_hash(table_obj):
+        try:
+            return csv_hashes[table_obj]
+        except KeyError:
+            csv_hash = csv_hashes[table_obj] = _hash_csv(
+                source, table_obj.name + '.csv')
+            return csv_hash
+
+    translation_tables = set(translation_class.__table__
+        for cls in pokedex.db.tables.mapped_classes
+        for translation_class in cls.translation_classes)
+    translations_hash = _hash_translations(source, langs)
+
+    if incremental:
+        print_start('Checking for changes')
+        changed_tables = set(table_obj for table_obj in table_objs
+            if manifest.get(table_obj.name) != get_csv_hash(table_obj))
+        if manifest.get(_translations_manifest_key) != translations_hash:
+            changed_tables.update(translation_tables.intersection(table_objs))
+        changed_tables.update(find_dependent_tables(changed_tables))
+        table_objs = sorted(changed_tables, key=lambda t: t.name)
+        drop_tables = True
+        print_done('%s tables' % len(table_objs))
+
     table_objs = sqlalchemy.sql.util.sort_tables(table_objs)
 
+    # Anything we're about to touch no longer matches its CSV file
+    if table_objs:
+        session.execute(manifest_table.delete().where(
+            manifest_table.c.table_name.in_([unicode(t.name) for t in table_objs])))
+    session.commit()
+
+    def record(table_obj, row_count):
+        if row_count is None:
+            print_done('missing?')
+            return
+        session.execute(manifest_table.insert(), dict(
+            table_name=unicode(table_obj.name),
+            csv_hash=get_csv_hash(table_obj),
+            row_count=row_count,
+        ))
+        session.commit()
+        print_done()
+
     # SQLite speed tweaks
     if not safe and session.connection().dialect.name == 'sqlite':
         session.connection().execute("PRAGMA synchronous=OFF")
@@ -150,10 +729,9 @@ def load(session, tables=[], directory=None, drop_tables=False, verbose=False, s
 
     # Drop all tables if requested
     if drop_tables:
-        bind = session.get_bind()
         print_start('Dropping tables')
         for n, table in enumerate(reversed(table_objs)):
-            table.drop(checkfirst=True)
+            table.drop(bind=bind, checkfirst=True)
 
             # Drop columns' types if appropriate; needed for enums in
             # postgresql
@@ -169,175 +747,204 @@ def load(session, tables=[], directory=None, drop_tables=False, verbose=False, s
         print_done()
 
     print_start('Creating tables')
+    # Unsafe loads create bare tables, and build the indexes (and on
+    # PostgreSQL, the foreign keys) once all the data is in
+    deferred_ddl = []
     for n, table in enumerate(table_objs):
-        table.create()
+        if safe:
+            table.create(bind=bind)
+        else:
+            deferred_ddl.extend(_create_bare_table(table, bind,
+                foreign_keys=bind.dialect.name != 'postgresql'))
         print_status('%s/%s' % (n, len(table_objs)))
     print_done()
-    connection = session.connection()
 
     # Okay, run through the tables and actually load the data now
-    for table_obj in table_objs:
-        table_name = table_obj.name
-        insert_stmt = table_obj.insert()
-
-        print_start(table_name)
+    if jobs > 1 and session.connection().dialect.name != 'sqlite':
+        # Tables in the same level of the dependency graph don't refer to
+        # each other, so each level can be loaded by several worker
+        # processes at once, each with its own connection.  Row conversion
+        # is CPU-bound, so threads wouldn't buy much here.
+        session.commit()
+        # Forked children must not inherit our pooled connections
+        bind.dispose()
+
+        # One pool for all levels, so workers keep their opened sources
+        with workers.worker_pool(jobs, initializer=workers.init_session,
+                initargs=(str(bind.url),)) as pool:
+            for level in group_into_levels(table_objs):
+                work = [(table_obj.name, source.location, safe, batch_size,
+                    pipeline) for table_obj in level]
+                for table_name, row_count, timing in workers.map_in_pool(
+                        pool, _load_table_in_worker, work):
+                    print_start(table_name)
+                    profile.add(timing)
+                    record(metadata.tables[table_name], row_count)
+    else:
+        # SQLite only has one writer at a time, so tables can only be
+        # pipelined one at a time
+        for table_obj in table_objs:
+            print_start(table_obj.name)
+            with profile.table(table_obj.name) as timing:
+                row_count = _load_table(session, table_obj, source,
+                    safe=safe, print_status=print_status, pipeline=pipeline,
+                    batch_size=batch_size, timing=timing)
+            record(table_obj, row_count)
 
-        try:
-            csvpath = "%s/%s.csv" % (directory, table_name)
-            csvfile = open(csvpath, 'rb')
-        except IOError:
-            # File doesn't exist; don't load anything!
-            print_done('missing?')
-            continue
 
-        csvsize = os.stat(csvpath).st_size
+    print_start('Translations')
+    new_row_count = 0
+    if translation_tables.intersection(table_objs):
+        transl = translations.Translations(csv_directory=source)
+
+        with profile.table('(translations)') as timing:
+            load_data = iter(transl.get_load_data(langs, batch_size=batch_size))
+            while True:
+                with timing.phase('parse'):
+                    try:
+                        translation_class, rows = next(load_data)
+                    except StopIteration:
+                        break
+                table_obj = translation_class.__table__
+                if table_obj in table_objs:
+                    with timing.phase('insert'):
+                        session.connection().execute(table_obj.insert(), rows)
+                    # We don't have a total, but at least show some increasing number
+                    new_row_count += len(rows)
+                    print_status(str(new_row_count))
+            # The batches are all part of one pass, so commit them together
+            with timing.phase('insert'):
+                session.commit()
+            timing.commits += 1
+            timing.rows = new_row_count
+
+    # The translations are only all there if every table that takes them was
+    # just reloaded
+    if translation_tables.issubset(table_objs):
+        session.execute(manifest_table.delete().where(
+            manifest_table.c.table_name == _translations_manifest_key))
+        session.execute(manifest_table.insert(), dict(
+            table_name=_translations_manifest_key,
+            csv_hash=translations_hash,
+            row_count=new_row_count,
+        ))
+    elif manifest.get(_translations_manifest_key) != translations_hash:
+        session.execute(manifest_table.delete().where(
+            manifest_table.c.table_name == _translations_manifest_key))
+    session.commit()
 
-        reader = csv.reader(csvfile, lineterminator='\n')
-        column_names = [unicode(column) for column in reader.next()]
+    print_done()
 
-        if not safe and session.connection().dialect.name == 'postgresql':
-            """
-            Postgres' CSV dialect works with our data, if we mark the not-null
-            columns with FORCE NOT NULL.
-            COPY is only allowed for DB superusers. If you're not one, use safe
-            loading (pokedex load -S).
-            """
-            session.commit()
-            not_null_cols = [c for c in column_names if not table_obj.c[c].nullable]
-            if not_null_cols:
-                force_not_null = 'FORCE NOT NULL ' + ','.join('"%s"' % c for c in not_null_cols)
-            else:
-                force_not_null = ''
-            command = "COPY %(table_name)s (%(columns)s) FROM '%(csvpath)s' CSV HEADER %(force_not_null)s"
-            session.connection().execute(
-                command % dict(
-                    table_name=table_name,
-                    csvpath=csvpath,
-                    columns=','.join('"%s"' % c for c in column_names),
-                    force_not_null=force_not_null,
-                )
-            )
+    if deferred_ddl:
+        print_start('Creating indexes')
+        with profile.table('(indexes)') as timing:
+            for n, ddl in enumerate(deferred_ddl):
+                session.connection().execute(ddl)
+                print_status('%s/%s' % (n, len(deferred_ddl)))
             session.commit()
-            print_done()
-            continue
-
-        # Self-referential tables may contain rows with foreign keys of other
-        # rows in the same table that do not yet exist.  Pull these out and add
-        # them to the session last
-        # ASSUMPTION: Self-referential tables have a single PK called "id"
-        deferred_rows = []  # ( row referring to id, [foreign ids we need] )
-        seen_ids = set()    # primary keys we've seen
-
-        # Fetch foreign key columns that point at this table, if any
-        self_ref_columns = []
-        for column in table_obj.c:
-            if any(x.references(table_obj) for x in column.foreign_keys):
-                self_ref_columns.append(column)
-
-        new_rows = []
-        def insert_and_commit():
-            if not new_rows:
-                return
-            session.connection().execute(insert_stmt, new_rows)
-            session.commit()
-            new_rows[:] = []
-
-            progress = "%d%%" % (100 * csvfile.tell() // csvsize)
-            print_status(progress)
-
-        for csvs in reader:
-            row_data = {}
-
-            for column_name, value in zip(column_names, csvs):
-                column = table_obj.c[column_name]
-                if column.nullable and value == '':
-                    # Empty string in a nullable column really means NULL
-                    value = None
-                elif isinstance(column.type, sqlalchemy.types.Boolean):
-                    # Boolean values are stored as string values 0/1, but both
-                    # of those evaluate as true; SQLA wants True/False
-                    if value == '0':
-                        value = False
-                    else:
-                        value = True
-                else:
-                    # Otherwise, unflatten from bytes
-                    value = value.decode('utf-8')
+            timing.commits += 1
+        print_done('%.1fs' % timing.wall)
 
-                # nb: Dictionaries flattened with ** have to have string keys
-                row_data[ str(column_name) ] = value
+    # SQLite check
+    if session.connection().dialect.name == 'sqlite':
+        session.connection().execute("PRAGMA integrity_check")
 
-            # May need to stash this row and add it later if it refers to a
-            # later row in this table
-            if self_ref_columns:
-                foreign_ids = set(row_data[x.name] for x in self_ref_columns)
-                foreign_ids.discard(None)  # remove NULL ids
+    # The SQLite check only covers the file structure, and unsafe loads don't
+    # enforce foreign keys at all, so check those separately
+    orphans = []
+    if check_foreign_keys and table_objs:
+        print_start('Checking foreign keys')
+        with profile.table('(foreign keys)') as timing:
+            orphans = verify(session, table_objs, jobs=jobs,
+                print_status=print_status)
+        if orphans:
+            print_done('%s orphans' % sum(count for _, count in orphans))
+            for description, count in orphans:
+                print_done("WARNING: %s rows of %s refer to nothing" % (
+                    count, description))
+        else:
+            print_done('%.1fs' % timing.wall)
 
-                if not foreign_ids:
-                    # NULL key.  Remember this row and add as usual.
-                    seen_ids.add(row_data['id'])
+    return orphans
 
-                elif foreign_ids.issubset(seen_ids):
-                    # Non-NULL key we've already seen.  Remember it and commit
-                    # so we know the old row exists when we add the new one
-                    insert_and_commit()
-                    seen_ids.add(row_data['id'])
 
-                else:
-                    # Non-NULL future id.  Save this and insert it later!
-                    deferred_rows.append((row_data, foreign_ids))
-                    continue
-
-            # Insert row!
-            new_rows.append(row_data)
-
-            # Remembering some zillion rows in the session consumes a lot of
-            # RAM.  Let's not do that.  Commit every 1000 rows
-            if len(new_rows) >= 1000:
-                insert_and_commit()
-
-        insert_and_commit()
-
-        # Attempt to add any spare rows we've collected
-        for row_data, foreign_ids in deferred_rows:
-            if not foreign_ids.issubset(seen_ids):
-                # Could happen if row A refers to B which refers to C.
-                # This is ridiculous and doesn't happen in my data so far
-                raise ValueError("Too many levels of self-reference!  "
-                                 "Row was: " + str(row))
-
-            session.connection().execute(
-                insert_stmt.values(**row_data)
-            )
-            seen_ids.add(row_data['id'])
-        session.commit()
 
-        print_done()
+def load_via_memory(path, verbose=False, **kwargs):
+    """Load data from CSV files into a new SQLite database file at `path`,
+    replacing whatever is there.
 
+    Everything is first loaded into an in-memory database, which is then
+    analyzed and written out to disk in one go.  The file is checked and
+    synced before it replaces the old one.
 
-    print_start('Translations')
-    transl = translations.Translations(csv_directory=directory)
+    Other keyword arguments are passed on to `load`, and its result is
+    returned.
+    """
+    print_start, print_status, print_done = get_verbose_prints(verbose)
 
-    new_row_count = 0
-    for translation_class, rows in transl.get_load_data(langs):
-        table_obj = translation_class.__table__
-        if table_obj in table_objs:
-            insert_stmt = table_obj.insert()
-            session.connection().execute(insert_stmt, rows)
-            session.commit()
-            # We don't have a total, but at least show some increasing number
-            new_row_count += len(rows)
-            print_status(str(new_row_count))
+    engine = sqlalchemy.create_engine('sqlite://')
+    session = Session(bind=engine)
+    orphans = load(session, verbose=verbose, safe=False, **kwargs)
 
+    print_start('Analyzing')
+    session.execute('ANALYZE')
+    session.commit()
     print_done()
 
-    # SQLite check
-    if session.connection().dialect.name == 'sqlite':
-        session.connection().execute("PRAGMA integrity_check")
-
+    print_start('Writing %s' % path)
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = session.connection()
+    raw_connection = connection.connection.connection
+    if hasattr(raw_connection, 'backup'):
+        target = sqlite3.connect(temp_path)
+        try:
+            raw_connection.backup(target)
+        finally:
+            target.close()
+    else:
+        # Python 2's sqlite3 has no online backup API; VACUUM INTO (SQLite
+        # 3.27+) writes out a compacted copy just the same
+        connection.execute('VACUUM INTO ?', temp_path)
+    session.close()
+    engine.dispose()
+    print_done()
 
+    print_start('Checking %s' % path)
+    target = sqlite3.connect(temp_path)
+    try:
+        result = target.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        target.close()
+    if result != [(u'ok',)]:
+        raise ValueError("Integrity check failed: %s" % (result,))
+
+    with open(temp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.rename(temp_path, path)
+    print_done()
 
-def dump(session, tables=[], directory=None, verbose=False, langs=['en']):
+    return orphans
+
+
+def _dump_table_in_worker(args):
+    """Dump one table in a worker process; see `dump`."""
+    table_name = args[0]
+    profile = Profile('dump')
+    try:
+        with profile.table(table_name) as timing:
+            changed = _dump_table(workers.session,
+                metadata.tables[table_name], *args[1:], timing=timing)
+    except Exception:
+        workers.session.rollback()
+        raise
+    finally:
+        # Don't sit on a read transaction between tables
+        workers.session.commit()
+    return table_name, changed, timing
+
+def dump(session, tables=[], directory=None, verbose=False, langs=['en'], profile=None, jobs=1):
     """Dumps the contents of a database to a set of CSV files.  Probably not
     useful to anyone besides a developer.
 
@@ -356,64 +963,180 @@ def dump(session, tables=[], directory=None, verbose=False, langs=['en']):
 
     `langs`
         List of identifiers of languages to dump unofficial texts for
+
+    `profile`
+        A `pokedex.timing.Profile` to record per-table timings in.
+
+    `jobs`
+        Number of tables to dump at once, each in its own worker process.
+
+    CSV files are only replaced if their contents changed, so unchanged files
+    keep their modification times.
     """
 
     # First take care of verbosity
-    print_start, print_status, print_done = _get_verbose_prints(verbose)
-
-    languages = dict((l.id, l) for l in session.query(pokedex.db.tables.Language))
+    print_start, print_status, print_done = get_verbose_prints(verbose)
+
+    if profile is None:
+        profile = Profile('dump')
+
+    # Work out which languages' texts to dump once, up front
+    language_table = pokedex.db.tables.Language.__table__
+    official_language_ids = set()
+    langs_language_ids = set()
+    for id, identifier, official in session.execute(sqlalchemy.select([
+            language_table.c.id, language_table.c.identifier,
+            language_table.c.official])):
+        if official:
+            official_language_ids.add(id)
+        if identifier in langs:
+            langs_language_ids.add(id)
 
     if not directory:
         directory = get_default_csv_dir()
 
-    table_names = _get_table_names(metadata, tables)
+    table_names = get_table_names(metadata, tables)
     table_names.sort()
 
 
-    for table_name in table_names:
-        print_start(table_name)
-        table = metadata.tables[table_name]
+    def print_result(changed):
+        if changed:
+            print_done()
+        else:
+            print_done('unchanged')
+
+    bind = session.get_bind()
+    if jobs > 1 and bind.url.database not in (None, '', ':memory:'):
+        # Every worker process reads through its own connection; an
+        # in-memory database can't be shared, so that's only dumped serially
+        session.commit()
+        bind.dispose()
+
+        work = [(table_name, directory, official_language_ids,
+            langs_language_ids) for table_name in table_names]
+        for table_name, changed, timing in workers.run_in_pool(
+                _dump_table_in_worker, work, jobs,
+                initializer=workers.init_session, initargs=(str(bind.url),)):
+            print_start(table_name)
+            profile.add(timing)
+            print_result(changed)
+    else:
+        for table_name in table_names:
+            print_start(table_name)
+            with profile.table(table_name) as timing:
+                changed = _dump_table(session, metadata.tables[table_name],
+                    directory, official_language_ids, langs_language_ids,
+                    timing=timing)
+            print_result(changed)
+
+def _dump_boolean(value):
+    if value:
+        return '1'
+    return '0'
+
+def _dump_text(value):
+    return value.encode('utf-8')
+
+def _dump_other(value):
+    # Convert Pythony values to something more universal
+    return unicode(value).encode('utf-8')
+
+def _make_dumpers(table):
+    """Returns a tuple of functions, one per column, that turn a value from
+    the database into a CSV value.  NULLs are left to the caller.
+    """
+    dumpers = []
+    for column in table.columns:
+        if isinstance(column.type, sqlalchemy.types.Boolean):
+            dumpers.append(_dump_boolean)
+        elif isinstance(column.type, sqlalchemy.types.Integer):
+            dumpers.append(str)
+        elif isinstance(column.type, sqlalchemy.types.Unicode):
+            dumpers.append(_dump_text)
+        else:
+            dumpers.append(_dump_other)
+    return tuple(dumpers)
+
+# How many rows dump fetches from the database at a time
+_dump_batch_size = 1000
 
-        writer = csv.writer(open("%s/%s.csv" % (directory, table_name), 'wb'),
-                            lineterminator='\n')
-        columns = [col.name for col in table.columns]
+def _dump_table(session, table, directory, official_language_ids,
+                langs_language_ids, timing=None):
+    """Dump a single table to its CSV file; see `dump`.
 
-        # For name tables, dump rows for official languages, as well as
-        # for those in `langs`.
-        # For other translation tables, only dump rows for languages in `langs`
-        # For non-translation tables, dump all rows.
-        if 'local_language_id' in columns:
-            if any(col.info.get('official') for col in table.columns):
-                def include_row(row):
-                    return (languages[row.local_language_id].official or
-                            languages[row.local_language_id].identifier in langs)
-            else:
-                def include_row(row):
-                    return languages[row.local_language_id].identifier in langs
+    Rows are streamed from the database a batch at a time (through a
+    server-side cursor where the driver has them), so memory use doesn't
+    depend on the size of the table.
+
+    The CSV is written to a temporary file first, and only replaces the real
+    one if it's different.  Returns whether it was.
+    """
+    if timing is None:
+        timing = TableTiming(table.name)
+
+    csvpath = "%s/%s.csv" % (directory, table.name)
+    temp_csvpath = csvpath + '.tmp'
+    columns = [col.name for col in table.columns]
+    dumpers = _make_dumpers(table)
+
+    def csv_row(row):
+        return [dump(value) if value is not None else ''
+            for dump, value in zip(dumpers, row)]
+
+    query = sqlalchemy.select(list(table.columns),
+        order_by=list(table.primary_key))
+
+    # For name tables, dump rows for official languages, as well as
+    # for those in `langs`.
+    # For other translation tables, only dump rows for languages in `langs`
+    # For non-translation tables, dump all rows.
+    # The database does the filtering, so unwanted rows are never even read
+    if 'local_language_id' in columns:
+        if any(col.info.get('official') for col in table.columns):
+            wanted_ids = official_language_ids | langs_language_ids
         else:
-            def include_row(row):
-                return True
+            wanted_ids = langs_language_ids
+        if wanted_ids:
+            query = query.where(
+                table.c.local_language_id.in_(sorted(wanted_ids)))
+        else:
+            # Nothing but the header, then
+            query = None
 
-        writer.writerow(columns)
+    connection = session.connection().execution_options(stream_results=True)
 
-        primary_key = table.primary_key
-        for row in session.query(table).order_by(*primary_key).all():
-            if include_row(row):
-                csvs = []
-                for col in columns:
-                    # Convert Pythony values to something more universal
-                    val = getattr(row, col)
-                    if val == None:
-                        val = ''
-                    elif val == True:
-                        val = '1'
-                    elif val == False:
-                        val = '0'
-                    else:
-                        val = unicode(val).encode('utf-8')
-
-                    csvs.append(val)
-
-                writer.writerow(csvs)
+    with open(temp_csvpath, 'wb') as csvfile:
+        writer = csv.writer(csvfile, lineterminator='\n')
+        writer.writerow(columns)
 
-        print_done()
+        if query is not None:
+            with timing.phase('query'):
+                result = connection.execute(query)
+            try:
+                while True:
+                    with timing.phase('query'):
+                        rows = result.fetchmany(_dump_batch_size)
+                    if not rows:
+                        break
+
+                    with timing.phase('write'):
+                        writer.writerows(map(csv_row, rows))
+                    timing.rows += len(rows)
+            finally:
+                result.close()
+
+    timing.bytes = os.stat(temp_csvpath).st_size
+
+    with timing.phase('compare'):
+        if (os.path.exists(csvpath) and
+                os.stat(csvpath).st_size == timing.bytes):
+            source = DirectorySource(directory)
+            changed = (_hash_csv(source, table.name + '.csv.tmp') !=
+                _hash_csv(source, table.name + '.csv'))
+        else:
+            changed = True
+    if changed:
+        os.rename(temp_csvpath, csvpath)
+    else:
+        os.remove(temp_csvpath)
+    return changed
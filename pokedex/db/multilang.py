@@ -1,7 +1,9 @@
+from contextlib import contextmanager
 from functools import partial
 
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
-from sqlalchemy.orm import Query, aliased, mapper, relationship, synonym
+from sqlalchemy.orm import Query, aliased, joinedload, mapper, relationship, synonym
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.orm.scoping import ScopedSession
 from sqlalchemy.orm.session import Session, object_session
@@ -208,6 +210,61 @@ def create_translation_table(_table_name, foreign_class, relation_name,
     # Done
     return Translations
 
+# How many IDs preload_names puts in one IN clause; SQLite only takes 999
+# parameters per query
+_preload_chunk_size = 500
+
+def preload_names(session, objects, relation_names=('names',), all_languages=False):
+    """Loads the translations of many objects at once.
+
+    Going through e.g. `obj.name` loads `obj.names_local` with one query per
+    object.  This instead loads the given translation relations (just `names`
+    by default) for all of `objects` with one query per translation table,
+    and fills in `(relation)_local` for the session's default language.  If
+    `all_languages` is true, the full `(relation)` collections (behind
+    `name_map` and friends) are filled in too.
+
+    `objects` may contain objects of several classes; a class that doesn't
+    have one of the relations is skipped.  Returns `objects`.
+    """
+    by_class = {}
+    for obj in objects:
+        by_class.setdefault(type(obj), []).append(obj)
+
+    language_id = session.default_language_id
+    for cls, class_objects in by_class.items():
+        for relation_name in relation_names:
+            translation_class = getattr(cls, relation_name + '_table', None)
+            if translation_class is None:
+                continue
+
+            ids = sorted(set(obj.id for obj in class_objects))
+            rows = {}
+            for start in range(0, len(ids), _preload_chunk_size):
+                query = session.query(translation_class).filter(
+                    translation_class.foreign_id.in_(
+                        ids[start:start + _preload_chunk_size]))
+                if all_languages:
+                    # The collections are keyed by language, so load those too
+                    query = query.options(joinedload('local_language'))
+                else:
+                    query = query.filter(
+                        translation_class.local_language_id == language_id)
+                for row in query:
+                    rows.setdefault(row.foreign_id, []).append(row)
+
+            local_relation_name = relation_name + '_local'
+            for obj in class_objects:
+                obj_rows = rows.get(obj.id, [])
+                local = [row for row in obj_rows
+                    if row.local_language_id == language_id]
+                set_committed_value(obj, local_relation_name,
+                    local[0] if local else None)
+                if all_languages:
+                    set_committed_value(obj, relation_name, obj_rows)
+
+    return objects
+
 class MultilangQuery(Query):
     def __iter__(self):
         if '_default_language_id' not in self._params:
@@ -239,6 +296,23 @@ class MultilangSession(Session):
 class MultilangScopedSession(ScopedSession):
     """Dispatches language selection to the attached Session."""
 
+    @contextmanager
+    def request_session(self, default_language_id=None):
+        """Provides this thread's session for one unit of work, such as a web
+        request, optionally in the given default language.
+
+        Afterwards, the session is closed, which returns its connection to the
+        pool; the thread's next session starts over with the default language.
+        Nothing is committed, so commit explicitly if you need to.
+        """
+        session = self.registry()
+        if default_language_id is not None:
+            session.default_language_id = default_language_id
+        try:
+            yield session
+        finally:
+            self.remove()
+
     @property
     def default_language_id(self):
         """Passes the new default language id through to the current session.
@@ -0,0 +1,196 @@
+"""Places CSV files can be read from.
+
+Both the loader and the translations code read CSV files by name, e.g.
+`pokemon.csv` or `translations/cs.csv`, from a "CSV directory".  That directory
+can be one of:
+
+- A plain directory.  Any file in it may also be gzipped, as `pokemon.csv.gz`.
+- A zip file.
+- A tarball, optionally gzipped or bzipped.
+
+Archives may keep the files in a subdirectory; the directory holding
+`languages.csv` is used as the root.
+
+Use `open_source` to get the right kind of source for a path.
+"""
+from cStringIO import StringIO
+import gzip
+import os
+import posixpath
+import struct
+import tarfile
+import zipfile
+
+__all__ = ['open_source', 'DirectorySource', 'ZipSource', 'TarSource']
+
+# File that every CSV directory has; used to find the root of archives
+_marker_filename = 'languages.csv'
+
+def open_source(location):
+    """Returns a CSV source for the given directory or archive path."""
+    if isinstance(location, _Source):
+        return location
+    if os.path.isdir(location):
+        return DirectorySource(location)
+    if zipfile.is_zipfile(location):
+        return ZipSource(location)
+    if os.path.isfile(location) and tarfile.is_tarfile(location):
+        return TarSource(location)
+    raise IOError("Not a CSV directory or archive: %s" % location)
+
+def _find_root(names):
+    """Returns the directory, within an archive, of the file that marks the
+    CSV root.
+    """
+    roots = [posixpath.dirname(name) for name in names
+        if posixpath.basename(name) == _marker_filename]
+    if not roots:
+        return ''
+    # If there are several, the shallowest one wins
+    return min(roots, key=lambda root: (root.count('/'), root))
+
+class _Source(object):
+    """Base class for CSV sources.
+
+    Names are always relative to the CSV root, and use forward slashes.
+    """
+    def __init__(self, location):
+        self.location = location
+
+    def open(self, name):
+        """Returns a binary file-like object for the named file, decompressing
+        as it's read.  Raises IOError if there's no such file.
+        """
+        raise NotImplementedError
+
+    def listdir(self, directory=''):
+        """Returns the names of the files in the given directory, with any
+        compression suffix removed.
+        """
+        raise NotImplementedError
+
+    def size(self, name):
+        """Returns the uncompressed size of the named file, or None if it
+        isn't known.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.location)
+
+class DirectorySource(_Source):
+    """CSV files in a directory, possibly gzipped one by one."""
+    def _path(self, name):
+        return os.path.join(self.location, *name.split('/'))
+
+    def open(self, name):
+        path = self._path(name)
+        try:
+            return open(path, 'rb')
+        except IOError:
+            if not os.path.exists(path + '.gz'):
+                raise
+        return gzip.open(path + '.gz', 'rb')
+
+    def listdir(self, directory=''):
+        names = set()
+        for filename in os.listdir(self._path(directory)):
+            if filename.endswith('.gz'):
+                filename = filename[:-3]
+            names.add(filename)
+        return sorted(names)
+
+    def size(self, name):
+        path = self._path(name)
+        if os.path.exists(path):
+            return os.stat(path).st_size
+
+        # gzip keeps the uncompressed size, modulo 2**32, in its last four
+        # bytes
+        try:
+            with open(path + '.gz', 'rb') as f:
+                f.seek(-4, os.SEEK_END)
+                return struct.unpack('<I', f.read(4))[0]
+        except IOError:
+            return None
+
+class ZipSource(_Source):
+    """CSV files in a zip file."""
+    def __init__(self, location):
+        super(ZipSource, self).__init__(location)
+        self.zipfile = zipfile.ZipFile(location)
+        self.root = _find_root(self.zipfile.namelist())
+
+    def _member(self, name):
+        return posixpath.join(self.root, name)
+
+    def open(self, name):
+        try:
+            return self.zipfile.open(self._member(name))
+        except KeyError:
+            raise IOError("No such file in %s: %s" % (self.location, name))
+
+    def listdir(self, directory=''):
+        prefix = self._member(directory).rstrip('/') + '/'
+        if prefix == '/':
+            prefix = ''
+        return sorted(name[len(prefix):] for name in self.zipfile.namelist()
+            if name.startswith(prefix) and '/' not in name[len(prefix):]
+            and name != prefix)
+
+    def size(self, name):
+        try:
+            return self.zipfile.getinfo(self._member(name)).file_size
+        except KeyError:
+            return None
+
+class TarSource(_Source):
+    """CSV files in a tarball, possibly compressed as a whole.
+
+    A compressed tarball can only be read from front to back, but CSV files
+    are needed in whatever order the tables load, and several at once for the
+    translations.  So the archive is read once, on first use, and its files
+    are kept in memory.  That's about as much memory as the CSV files take up
+    on disk.
+    """
+    def __init__(self, location):
+        super(TarSource, self).__init__(location)
+        self._files = None
+
+    def _read(self):
+        if self._files is None:
+            files = {}
+            tar = tarfile.open(self.location, 'r|*')
+            try:
+                for member in tar:
+                    if member.isfile():
+                        files[member.name] = tar.extractfile(member).read()
+            finally:
+                tar.close()
+            root = _find_root(files)
+            if root:
+                prefix = root + '/'
+                files = dict((name[len(prefix):], contents)
+                    for name, contents in files.items()
+                    if name.startswith(prefix))
+            self._files = files
+        return self._files
+
+    def open(self, name):
+        try:
+            return StringIO(self._read()[name])
+        except KeyError:
+            raise IOError("No such file in %s: %s" % (self.location, name))
+
+    def listdir(self, directory=''):
+        prefix = directory.rstrip('/') + '/'
+        if prefix == '/':
+            prefix = ''
+        return sorted(name[len(prefix):] for name in self._read()
+            if name.startswith(prefix) and '/' not in name[len(prefix):])
+
+    def size(self, name):
+        try:
+            return len(self._read()[name])
+        except KeyError:
+            return None
@@ -33,6 +33,8 @@ import sys
 from collections import defaultdict
 
 from pokedex.db import tables
+from pokedex.db.source import open_source
+from pokedex.db.workers import get_source, run_in_pool
 from pokedex.defaults import get_default_csv_dir
 
 default_source_lang = 'en'
@@ -76,7 +78,7 @@ class Message(object):
     cls: Name of the mapped class the message belongs to
     id: The id of the thing the message belongs to
     colname: name of the database column
-    strings: A list of strings in the message, usualy of length 1.
+    strings: A tuple of strings in the message, usualy of length 1.
 
     Optional attributes (None if not set):
     colsize: Max length of the database column
@@ -98,7 +100,7 @@ class Message(object):
         self.cls = cls
         self.id = id
         self.colname = colname
-        self.strings = [string]
+        self.strings = (string,)
         self.colsize = colsize
         self.source = source
         self.number_replacement = number_replacement
@@ -117,13 +119,26 @@ class Message(object):
         assert self.merge_key == other.merge_key
         for string in other.strings:
             if string not in self.strings:
-                self.strings.append(string)
+                self.strings += (string,)
         self.colsize = self.colsize or other.colsize
         self.pot = self.pot or other.pot
         self.source = None
         self.source_crc = None
         self.number_replacement = None
 
+    @property
+    def row(self):
+        """All of the message's attributes, as a tuple; see `from_row`"""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_row(cls, row):
+        """Make a message from the tuple its `row` property gave"""
+        message = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, row):
+            setattr(message, name, value)
+        return message
+
     @property
     def string(self):
         return '\n\n'.join(self.strings)
@@ -162,10 +177,19 @@ class Message(object):
 
 class Translations(object):
     """Data and opertaions specific to a location on disk (and a source language)
+
+    `csv_directory` may be anything `pokedex.db.source.open_source` takes, or
+    a source it made.  Only a plain directory can have translations written
+    to it, though.
+
+    `jobs` is the number of worker processes to read the source CSVs with;
+    see `yield_source_messages`.
     """
-    def __init__(self, source_lang=default_source_lang, csv_directory=None, translation_directory=None):
+    def __init__(self, source_lang=default_source_lang, csv_directory=None, translation_directory=None, jobs=1):
         if csv_directory is None:
             csv_directory = get_default_csv_dir()
+        self.csv_source = open_source(csv_directory)
+        csv_directory = self.csv_source.location
 
         if translation_directory is None:
             translation_directory = os.path.join(csv_directory, 'translations')
@@ -173,6 +197,7 @@ class Translations(object):
         self.source_lang = default_source_lang
         self.csv_directory = csv_directory
         self.translation_directory = translation_directory
+        self.jobs = jobs
 
         self.language_ids = {}
         self.language_identifiers = {}
@@ -187,7 +212,8 @@ class Translations(object):
 
     @classmethod
     def from_parsed_options(cls, options):
-        return cls(options.source_lang, options.directory)
+        return cls(options.source_lang, options.directory,
+            jobs=getattr(options, 'jobs', 1))
 
     @property
     def source(self):
@@ -257,53 +283,75 @@ class Translations(object):
 
     def reader_for_class(self, cls, reader_class=csv.reader):
         tablename = cls.__table__.name
-        csvpath = os.path.join(self.csv_directory, tablename + '.csv')
-        return reader_class(open(csvpath, 'rb'), lineterminator='\n')
+        csvfile = self.csv_source.open(tablename + '.csv')
+        return reader_class(csvfile, lineterminator='\n')
 
     def writer_for_lang(self, lang):
         csvpath = os.path.join(self.translation_directory, '%s.csv' % lang)
         return csv.writer(open(csvpath, 'wb'), lineterminator='\n')
 
-    def yield_source_messages(self, language_id=None):
+    def yield_source_messages(self, language_id=None, jobs=None):
         """Yield all messages from source CSV files
 
         Messages from all languages are returned. The messages are not ordered
         properly, but splitting the stream by language (and filtering results
         by merge_adjacent) will produce proper streams.
+
+        With more than one job (the default is self.jobs), each class's
+        messages are read and merged in a pool of worker processes.  The
+        classes come back in order, so the stream is the same either way.
+        Starting the workers and sending the messages back costs more than
+        reading the bundled CSVs, so this only pays off with several CPUs
+        and larger data; serial is the default.
         """
         if language_id is None:
             language_id = self.source_lang_id
+        if jobs is None:
+            jobs = self.jobs
+
+        class_names = sorted(cls.__name__ for cls in toplevel_classes)
+        if jobs > 1:
+            work = [(self.csv_source.location, name) for name in class_names]
+            for rows in run_in_pool(_class_source_messages_in_worker,
+                    work, jobs, ordered=True):
+                for row in rows:
+                    yield Message.from_row(row)
+        else:
+            for name in class_names:
+                for message in self.yield_class_source_messages(name):
+                    yield message
 
-        for cls in sorted(toplevel_classes, key=lambda c: c.__name__):
-            streams = []
-            for translation_class in cls.translation_classes:
-                streams.append(yield_source_csv_messages(
-                        translation_class,
-                        cls,
-                        self.reader_for_class(translation_class),
-                    ))
-                try:
-                    colmap = summary_map[translation_class]
-                except KeyError:
-                    pass
-                else:
-                    for colname, summary_class in colmap.items():
-                        column = translation_class.__table__.c[colname]
-                        streams.append(yield_source_csv_messages(
-                                summary_class,
-                                cls,
-                                self.reader_for_class(summary_class),
-                                force_column=column,
-                            ))
-            for message in Merge(*streams):
-                yield message
+    def yield_class_source_messages(self, class_name):
+        """Yield all messages from the source CSV files of one top-level class
+        """
+        cls = toplevel_class_by_name[class_name]
+        streams = []
+        for translation_class in cls.translation_classes:
+            streams.append(yield_source_csv_messages(
+                    translation_class,
+                    cls,
+                    self.reader_for_class(translation_class),
+                ))
+            try:
+                colmap = summary_map[translation_class]
+            except KeyError:
+                pass
+            else:
+                for colname, summary_class in colmap.items():
+                    column = translation_class.__table__.c[colname]
+                    streams.append(yield_source_csv_messages(
+                            summary_class,
+                            cls,
+                            self.reader_for_class(summary_class),
+                            force_column=column,
+                        ))
+        return Merge(*streams)
 
     def yield_target_messages(self, lang):
         """Yield messages from the data/csv/translations/<lang>.csv file
         """
-        path = os.path.join(self.csv_directory, 'translations', '%s.csv' % lang)
         try:
-            file = open(path, 'rb')
+            file = self.csv_source.open('translations/%s.csv' % lang)
         except IOError:
             return ()
         return yield_translation_csv_messages(file)
@@ -314,51 +362,64 @@ class Translations(object):
             stream.add_iterator(self.yield_target_messages(lang))
         return (message for message in stream if not message.official)
 
-    def get_load_data(self, langs=None):
+    def get_load_data(self, langs=None, batch_size=1000):
         """Yield (translation_class, data for INSERT) pairs for loading into the DB
 
         langs is either a list of language identifiers or None
+
+        Only the translation CSVs for those languages are read, one after
+        another.  Rows are collected per translation class and yielded in
+        lists of batch_size (the last ones may be shorter), so memory use
+        doesn't grow with the number of translations.
         """
         if langs is None:
             langs = self.language_identifiers.values()
-        stream = Merge()
-        for lang in self.language_identifiers.values():
-            stream.add_iterator(self.yield_target_messages(lang))
-        stream = (message for message in stream if not message.official)
-        count = 0
-        class GroupDict(dict):
-            """Dict to automatically set the foreign_id and local_language_id for new items
-            """
-            def __missing__(self, key):
-                # depends on `cls` from outside scope
-                id, language_id = key
-                data = self[key] = defaultdict(lambda: None)
-                column_names = (c.name for c in translation_class.__table__.columns)
-                data.update(dict.fromkeys(column_names))
-                data.update({
-                        '%s_id' % cls.__singlename__: id,
-                        'local_language_id': language_id,
-                    })
-                return data
-        # Nested dict:
-        # translation_class -> (lang, id) -> column -> value
-        everything = defaultdict(GroupDict)
-        # Group by object so we always have all of the messages for one DB row
-        for (cls_name, id), group in group_by_object(stream):
-            cls = toplevel_class_by_name[cls_name]
-            for message in group:
-                translation_class = translation_class_by_column[cls, message.colname]
-                key = id, message.language_id
-                colname = str(message.colname)
-                everything[translation_class][key][colname] = message.string
-                count += 1
-            if count > 1000:
-                for translation_class, key_data in everything.items():
-                    yield translation_class, key_data.values()
-                count = 0
-                everything.clear()
-        for translation_class, data_dict in everything.items():
-            yield translation_class, data_dict.values()
+        column_names = {}
+        batches = defaultdict(list)
+        for lang in sorted(set(langs)):
+            stream = (message for message in self.yield_target_messages(lang)
+                if not message.official)
+            # Each file is sorted by object, so grouping by object gives us all
+            # of the messages for one DB row
+            for (cls_name, id), group in group_by_object(stream):
+                cls = toplevel_class_by_name[cls_name]
+                rows = {}
+                for message in group:
+                    translation_class = translation_class_by_column[cls, message.colname]
+                    key = translation_class, message.language_id
+                    try:
+                        row = rows[key]
+                    except KeyError:
+                        try:
+                            names = column_names[translation_class]
+                        except KeyError:
+                            names = column_names[translation_class] = [
+                                c.name for c in translation_class.__table__.columns]
+                        row = rows[key] = dict.fromkeys(names)
+                        row.update({
+                                '%s_id' % cls.__singlename__: id,
+                                'local_language_id': message.language_id,
+                            })
+                    row[str(message.colname)] = message.string
+                for (translation_class, language_id), row in rows.items():
+                    batch = batches[translation_class]
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        yield translation_class, batch
+                        batches[translation_class] = []
+        for translation_class, batch in batches.items():
+            if batch:
+                yield translation_class, batch
+
+def _class_source_messages_in_worker(args):
+    """Read one class's source messages in a worker process; see
+    `Translations.yield_source_messages`.
+    """
+    location, class_name = args
+    transl = Translations(csv_directory=get_source(location))
+    # Plain tuples pickle much faster than objects with __slots__
+    return [message.row for message in
+        transl.yield_class_source_messages(class_name)]
 
 def group_by_object(stream):
     """Group stream by object
@@ -378,16 +439,34 @@ def group_by_object(stream):
         current_key = current.cls, current.id
     yield current_key, group
 
+def _merge_key(value):
+    """Default key for Merge: messages sort by their sort_key, anything else
+    by itself
+    """
+    if isinstance(value, Message):
+        return value.sort_key
+    return value
+
 class Merge(object):
     """Merge several sorted iterators together
 
     Additional iterators may be added at any time with add_iterator.
     Accepts None for the initial iterators
     If the same value appears in more iterators, there will be duplicates in
-    the output.
+    the output; they come out in the order their iterators were added.
+
+    Each value's sort key is computed once, when it's read, and the heap
+    compares those.  Comparing Messages directly would rebuild both keys on
+    every comparison.  Pass `key` to sort by something else.
     """
-    def __init__(self, *iterators):
+    def __init__(self, *iterators, **kwargs):
+        self.key = kwargs.pop('key', _merge_key)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kwargs))
+        # Heap of (key, iterator number, value, iterator); the number breaks
+        # ties, so values and iterators are never compared themselves
         self.next_values = []
+        self.counter = itertools.count()
         for iterator in iterators:
             if iterator is not None:
                 self.add_iterator(iterator)
@@ -399,18 +478,25 @@ class Merge(object):
         except StopIteration:
             return
         else:
-            heapq.heappush(self.next_values, (value, iterator))
+            heapq.heappush(self.next_values,
+                (self.key(value), self.counter.next(), value, iterator))
 
     def __iter__(self):
         return self
 
     def next(self):
-        if self.next_values:
-            value, iterator = heapq.heappop(self.next_values)
-            self.add_iterator(iterator)
-            return value
-        else:
+        if not self.next_values:
             raise StopIteration
+        # Pop before reading on: reading may add iterators
+        key, number, value, iterator = heapq.heappop(self.next_values)
+        try:
+            new_value = iterator.next()
+        except StopIteration:
+            pass
+        else:
+            heapq.heappush(self.next_values,
+                (self.key(new_value), number, new_value, iterator))
+        return value
 
 def merge_adjacent(gen):
     """Merge adjacent messages that compare equal"""
@@ -557,9 +643,9 @@ def yield_translation_csv_messages(file, no_header=False):
         assert columns == 'language_id,table,id,column,source_crc,string'.split(',')
     for language_id, table, id, column, source_crc, string in csvreader:
         yield Message(
-                table,
+                intern(table),
                 int(id),
-                column,
+                intern(column),
                 string.decode('utf-8'),
                 origin='target CSV',
                 source_crc=source_crc,
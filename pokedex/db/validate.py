@@ -0,0 +1,296 @@
+"""Checking CSV files against the schema, before loading them."""
+import csv
+import multiprocessing
+
+import sqlalchemy.types
+
+from pokedex.db import metadata
+from pokedex.db.load import get_table_names, get_verbose_prints
+from pokedex.db.source import open_source
+from pokedex.db.workers import get_source, run_in_pool
+from pokedex.defaults import get_default_csv_dir
+
+__all__ = ['validate']
+
+# Report at most this many problems per table; past that, only count them
+max_problems_per_table = 20
+
+class _Invalid(ValueError):
+    pass
+
+def _check_integer(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise _Invalid("not an integer: %r" % value)
+
+def _check_boolean(value):
+    if value not in ('0', '1'):
+        raise _Invalid("not a boolean (0 or 1): %r" % value)
+    return value == '1'
+
+def _make_string_checker(length):
+    def check_string(value):
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            raise _Invalid("not valid UTF-8: %r" % value)
+        if length is not None and len(value) > length:
+            raise _Invalid("%d characters long, but the column only takes %d" % (
+                len(value), length))
+        return value
+    return check_string
+
+def _make_enum_checker(values):
+    values = frozenset(values)
+    def check_enum(value):
+        if value not in values:
+            raise _Invalid("not one of %s: %r" % (
+                ', '.join(sorted(values)), value))
+        return value
+    return check_enum
+
+def _make_checker(column):
+    """Returns a function that checks a CSV value for the given column, and
+    returns it as the loader would convert it.  Raises _Invalid for bad
+    values.
+    """
+    type_ = column.type
+    is_string = False
+    if isinstance(type_, sqlalchemy.types.Boolean):
+        check = _check_boolean
+    elif isinstance(type_, sqlalchemy.types.Integer):
+        check = _check_integer
+    elif isinstance(type_, sqlalchemy.types.Enum):
+        check = _make_enum_checker(type_.enums)
+    elif isinstance(type_, sqlalchemy.types.String):
+        check = _make_string_checker(type_.length)
+        is_string = True
+    else:
+        check = lambda value: value
+
+    if column.nullable:
+        def check_or_null(value):
+            # Empty string in a nullable column really means NULL
+            if value == '':
+                return None
+            return check(value)
+        return check_or_null
+    elif is_string:
+        # ...but it's just an empty string in a non-nullable one
+        return check
+    else:
+        def check_not_null(value):
+            if value == '':
+                raise _Invalid("empty, but the column isn't nullable")
+            return check(value)
+        return check_not_null
+
+def _key_columns(table):
+    """Names of this table's columns that other tables refer to."""
+    return sorted(set(fk.column.name
+        for other_table in metadata.tables.values()
+        for fk in other_table.foreign_keys
+        if fk.column.table is table))
+
+def _validate_table(source, table, full=True):
+    """Checks one table's CSV file.
+
+    Returns (problems, keys, references), where `problems` is a list of
+    messages; `keys` maps (table name, column name) to the set of values of
+    each column other tables refer to; and `references` maps (table name,
+    column name, referred table name, referred column name) to the set of
+    values used by each foreign key column.
+
+    If `full` is false, only `keys` is filled in.
+    """
+    problems = []
+    problem_count = [0]
+    def problem(message):
+        problem_count[0] += 1
+        if problem_count[0] <= max_problems_per_table:
+            problems.append(message)
+
+    csvname = table.name + '.csv'
+    try:
+        csvfile = source.open(csvname)
+    except IOError:
+        return ["%s: no CSV file" % csvname], {}, {}
+
+    reader = csv.reader(csvfile, lineterminator='\n')
+    try:
+        column_names = reader.next()
+    except StopIteration:
+        return ["%s: empty file, not even a header" % csvname], {}, {}
+
+    # Header
+    for name in column_names:
+        if name not in table.c:
+            problem("%s: unknown column %s" % (csvname, name))
+    for column in table.columns:
+        if (column.name not in column_names and not column.nullable
+                and column.default is None
+                and column is not table._autoincrement_column):
+            problem("%s: column %s is missing, but isn't nullable" % (
+                csvname, column.name))
+    if problems:
+        # Can't make much sense of the rows, then
+        return problems, {}, {}
+
+    columns = [table.c[name] for name in column_names]
+    key_names = _key_columns(table)
+    if full:
+        checked = range(len(columns))
+    else:
+        checked = [column_names.index(name) for name in key_names
+            if name in column_names]
+    checkers = [(index, columns[index].name, _make_checker(columns[index]))
+        for index in checked]
+
+    pk_indices = [column_names.index(column.name)
+        for column in table.primary_key if column.name in column_names]
+    seen_pks = {}
+
+    key_values = dict((name, set()) for name in key_names
+        if name in column_names)
+    reference_values = {}
+    if full:
+        for index, column in enumerate(columns):
+            for fk in column.foreign_keys:
+                reference_values[index, fk.column.table.name, fk.column.name] = set()
+
+    for csvs in reader:
+        line = reader.line_num
+        if len(csvs) != len(column_names):
+            if full:
+                problem("%s line %d: %d values, but %d columns" % (
+                    csvname, line, len(csvs), len(column_names)))
+            continue
+
+        row = list(csvs)
+        bad = False
+        for index, name, check in checkers:
+            try:
+                row[index] = check(csvs[index])
+            except _Invalid, e:
+                problem("%s line %d, column %s: %s" % (csvname, line, name, e))
+                bad = True
+        if bad:
+            continue
+
+        if full and pk_indices:
+            pk = tuple(row[index] for index in pk_indices)
+            if pk in seen_pks:
+                problem("%s line %d: duplicate primary key %s, first seen on "
+                    "line %d" % (csvname, line,
+                        ', '.join(map(str, pk)), seen_pks[pk]))
+            else:
+                seen_pks[pk] = line
+
+        for name, values in key_values.items():
+            values.add(row[column_names.index(name)])
+        for (index, _, _), values in reference_values.items():
+            if row[index] is not None:
+                values.add(row[index])
+
+    if problem_count[0] > len(problems):
+        problems.append("%s: ...and %d more problems" % (
+            csvname, problem_count[0] - len(problems)))
+
+    keys = dict(((table.name, name), values)
+        for name, values in key_values.items())
+    references = dict(
+        ((table.name, column_names[index], ref_table, ref_column), values)
+        for (index, ref_table, ref_column), values in reference_values.items())
+    return problems, keys, references
+
+def _validate_table_in_worker(args):
+    """Check one table in a worker process; see `validate`."""
+    table_name, location, full = args
+    result = _validate_table(get_source(location), metadata.tables[table_name],
+        full)
+    return (table_name, full) + result
+
+def validate(tables=[], directory=None, verbose=False, jobs=None):
+    """Checks CSV files against the schema without touching a database.
+
+    Every value is checked against its column's type, length and
+    nullability; primary keys must be unique; and foreign keys must refer to
+    rows that exist in the CSV files.
+
+    Returns a list of problems found, as messages.  If it's empty, all is
+    well.
+
+    `tables`
+        List of tables to check.  If omitted, all tables are checked.  The
+        tables they refer to are read too, for checking foreign keys.
+
+    `directory`
+        Directory (or archive) the CSV files are in.  Defaults to the
+        `pokedex` data directory.
+
+    `verbose`
+        If set to True, status messages will be printed to stdout.
+
+    `jobs`
+        Number of tables to check at once, each in its own worker process.
+        Defaults to the number of CPUs.
+    """
+    print_start, print_status, print_done = get_verbose_prints(verbose)
+
+    if directory is None:
+        directory = get_default_csv_dir()
+    source = open_source(directory)
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    table_names = sorted(get_table_names(metadata, tables))
+    referred_names = sorted(set(fk.column.table.name
+        for table_name in table_names
+        for fk in metadata.tables[table_name].foreign_keys
+        ).difference(table_names))
+    work = ([(table_name, source.location, True) for table_name in table_names] +
+        [(table_name, source.location, False) for table_name in referred_names])
+
+    all_problems = {}
+    keys = {}
+    references = {}
+    def collect(table_name, full, problems, table_keys, table_references):
+        if full:
+            print_start(table_name)
+            if problems:
+                print_done('%d problems' % len(problems))
+            else:
+                print_done()
+            all_problems[table_name] = problems
+        keys.update(table_keys)
+        references.update(table_references)
+
+    if jobs > 1:
+        for result in run_in_pool(_validate_table_in_worker, work, jobs):
+            collect(*result)
+    else:
+        for table_name, location, full in work:
+            collect(table_name, full, *_validate_table(
+                source, metadata.tables[table_name], full))
+
+    print_start('Foreign keys')
+    fk_problem_count = 0
+    for (table_name, column_name, ref_table, ref_column), values in sorted(references.items()):
+        missing = values - keys.get((ref_table, ref_column), set())
+        if missing:
+            fk_problem_count += 1
+            missing = sorted(missing)
+            all_problems.setdefault(table_name, []).append(
+                "%s.csv, column %s: %d values not in %s.%s: %s%s" % (
+                    table_name, column_name, len(missing), ref_table,
+                    ref_column, ', '.join(map(str, missing[:10])),
+                    ', ...' if len(missing) > 10 else ''))
+    if fk_problem_count:
+        print_done('%d problems' % fk_problem_count)
+    else:
+        print_done()
+
+    return [problem for table_name in sorted(all_problems)
+        for problem in all_problems[table_name]]
@@ -0,0 +1,128 @@
+"""Checking a loaded database's foreign keys, in bulk."""
+import sqlalchemy
+from sqlalchemy import ForeignKeyConstraint, and_, func
+
+from pokedex.db import metadata, workers
+
+__all__ = ['verify']
+
+def _orphan_query(constraint):
+    """Returns a query counting the rows whose foreign key, per `constraint`,
+    doesn't refer to an existing row.
+
+    This is an anti-join: every row is outer-joined to the row it refers to,
+    and the ones that come up empty are counted.  The database can do that in
+    one pass over each table, rather than a lookup per row.
+    """
+    table = constraint.table
+    referred = constraint.elements[0].column.table.alias('referred')
+    join_condition = and_(*[referred.c[fk.column.name] == fk.parent
+        for fk in constraint.elements])
+    # Rows with a NULL anywhere in the key don't refer to anything
+    not_null = [fk.parent != None for fk in constraint.elements]
+    missing = referred.c[constraint.elements[0].column.name] == None
+    return sqlalchemy.select([func.count()],
+        from_obj=table.outerjoin(referred, join_condition),
+        whereclause=and_(missing, *not_null))
+
+def _describe(constraint):
+    return "%s.%s -> %s.%s" % (
+        constraint.table.name,
+        ', '.join(fk.parent.name for fk in constraint.elements),
+        constraint.elements[0].column.table.name,
+        ', '.join(fk.column.name for fk in constraint.elements))
+
+def _foreign_key_constraints(table, missing=()):
+    """Returns the table's foreign key constraints, except those referring to
+    a table whose name is in `missing`.
+    """
+    return sorted((constraint for constraint in table.constraints
+            if isinstance(constraint, ForeignKeyConstraint)
+            and constraint.elements[0].column.table.name not in missing),
+        key=_describe)
+
+def _verify_table(connection, table, missing=()):
+    """Returns a list of (constraint description, orphan count) for each of
+    the table's foreign keys, skipping those referring to `missing` tables.
+    """
+    return [(_describe(constraint),
+            connection.execute(_orphan_query(constraint)).scalar())
+        for constraint in _foreign_key_constraints(table, missing)]
+
+def _verify_table_in_worker(args):
+    """Check one table in a worker process; see `verify`."""
+    table_name, missing = args
+    try:
+        return table_name, _verify_table(workers.session.connection(),
+            metadata.tables[table_name], missing)
+    finally:
+        workers.session.rollback()
+
+def verify(session, tables=None, jobs=1, print_status=None):
+    """Checks that every foreign key in the database refers to an existing
+    row.
+
+    Unlike SQLite's `PRAGMA integrity_check`, which only looks at the file
+    structure, this runs one anti-join query per foreign key, so it catches
+    rows that lost their referred row, e.g. after an unsafe or partial load.
+
+    Returns a list of (foreign key description, orphan count) for the
+    foreign keys that have orphans.  If it's empty, all is well.
+
+    `session`
+        SQLAlchemy session to use.
+
+    `tables`
+        List of table objects whose foreign keys should be checked.  If
+        omitted, all tables are checked.  Tables that aren't in the
+        database, and foreign keys referring to such tables, are skipped,
+        so a database with only some tables loaded can be checked too.
+
+    `jobs`
+        Number of tables to check at once, each in its own worker process
+        with its own connection.  SQLite is always checked in this process.
+
+    `print_status`
+        Function to call with progress messages, if any.
+    """
+    if print_status is None:
+        print_status = lambda msg: None
+
+    if tables is None:
+        tables = metadata.tables.values()
+
+    # Look for each table involved once, up front
+    connection = session.connection()
+    involved = set(tables)
+    for table in tables:
+        involved.update(constraint.elements[0].column.table
+            for constraint in _foreign_key_constraints(table))
+    missing = frozenset(table.name for table in involved
+        if not connection.dialect.has_table(connection, table.name,
+            schema=table.schema))
+
+    tables = sorted((table for table in tables
+            if table.name not in missing
+            and _foreign_key_constraints(table, missing)),
+        key=lambda table: table.name)
+
+    results = []
+    bind = session.get_bind()
+    if jobs > 1 and bind.dialect.name != 'sqlite':
+        # Make sure the workers can see everything we've done
+        session.commit()
+        bind.dispose()
+
+        for n, (table_name, table_results) in enumerate(workers.run_in_pool(
+                _verify_table_in_worker,
+                [(table.name, missing) for table in tables], jobs,
+                initializer=workers.init_session, initargs=(str(bind.url),))):
+            results.extend(table_results)
+            print_status('%s/%s' % (n, len(tables)))
+    else:
+        for n, table in enumerate(tables):
+            results.extend(_verify_table(connection, table, missing))
+            print_status('%s/%s' % (n, len(tables)))
+
+    return sorted((description, count)
+        for description, count in results if count)
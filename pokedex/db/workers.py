@@ -0,0 +1,99 @@
+"""Running work in a pool of worker processes.
+
+`load`, `dump`, `verify`, `validate` and the translation tools split their
+work by table or class, and hand it to `run_in_pool`, or to `map_in_pool` to
+use one `worker_pool` for several rounds of work.  Workers that need the
+database use the session set up by `init_session`, and workers that read CSV
+files get their source from `get_source`.
+"""
+from contextlib import contextmanager
+import multiprocessing
+import traceback
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from pokedex.db.source import open_source
+
+__all__ = ['run_in_pool', 'worker_pool', 'map_in_pool', 'init_session',
+    'session', 'get_source']
+
+# Session for worker functions to use; set up by init_session, in worker
+# processes
+session = None
+
+def init_session(url):
+    """Pool initializer that connects the worker to the database at `url`.
+
+    The parent should dispose of its own engine first, so the forked workers
+    don't inherit its pooled connections.
+    """
+    global session
+    session = Session(bind=sqlalchemy.create_engine(url))
+
+# Sources opened by get_source, by location
+_sources = {}
+
+def get_source(location):
+    """Returns a source (see `pokedex.db.source`) for `location`, opening it
+    only the first time.  Workers handle many tables from the same place, and
+    reading a tarball once per worker is plenty.
+    """
+    try:
+        return _sources[location]
+    except KeyError:
+        source = _sources[location] = open_source(location)
+        return source
+
+def _call(args):
+    func, item = args
+    try:
+        return func(item)
+    except Exception:
+        # Exceptions from database drivers don't always survive pickling;
+        # send the formatted traceback back instead
+        raise RuntimeError("%s(%r) failed:\n%s" % (
+            func.__name__, item, traceback.format_exc()))
+
+@contextmanager
+def worker_pool(jobs, initializer=None, initargs=()):
+    """Context manager for a pool of `jobs` worker processes.
+
+    If the block raises, or a generator using the pool is closed early, the
+    pool is terminated; otherwise it's left to finish its work.  Either way,
+    the workers are gone afterwards.
+    """
+    pool = multiprocessing.Pool(jobs, initializer=initializer,
+        initargs=initargs)
+    try:
+        yield pool
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+def map_in_pool(pool, func, work, ordered=False):
+    """Calls `func` on each item of `work` in the given pool, and returns an
+    iterator over the results.
+
+    `func` must be a module-level function, so it can be pickled.  The
+    results come in whatever order they're ready in, unless `ordered` is
+    set.
+    """
+    if ordered:
+        imap = pool.imap
+    else:
+        imap = pool.imap_unordered
+    return imap(_call, [(func, item) for item in work])
+
+def run_in_pool(func, work, jobs, initializer=None, initargs=(),
+        ordered=False):
+    """Calls `func` on each item of `work` in a new pool of `jobs` worker
+    processes, and yields the results; see `worker_pool` and `map_in_pool`.
+    """
+    with worker_pool(jobs, initializer, initargs) as pool:
+        for result in map_in_pool(pool, func, work, ordered):
+            yield result
@@ -2,6 +2,11 @@
 
 import os
 
+# How many rows `pokedex load` inserts at a time, by default.  Bigger batches
+# mean fewer commits, which is most of the cost on SQLite.  (It lives here so
+# `pokedex help` can show it without importing the loader.)
+default_batch_size = 5000
+
 def get_default_db_uri_with_origin():
     uri = os.environ.get('POKEDEX_DB_ENGINE', None)
     origin = 'environment'
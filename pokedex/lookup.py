@@ -22,6 +22,7 @@ from pokedex.db import connect
 import pokedex.db.tables as tables
 from pokedex.roomaji import romanize
 from pokedex.defaults import get_default_index_dir
+from pokedex.timing import Profile
 
 __all__ = ['PokedexLookup']
 
@@ -166,8 +167,13 @@ class PokedexLookup(object):
                 "Please use a dedicated directory for the lookup index."
             )
 
-    def rebuild_index(self):
-        """Creates the index from scratch."""
+    def rebuild_index(self, profile=None):
+        """Creates the index from scratch.
+
+        If a `pokedex.timing.Profile` is given, each indexed table is timed.
+        """
+        if profile is None:
+            profile = Profile('reindex')
 
         schema = whoosh.fields.Schema(
             name=whoosh.fields.ID(stored=True, spelling=True),
@@ -194,41 +200,45 @@ class PokedexLookup(object):
 
         # Index every name in all our tables of interest
         for cls in self.indexed_tables.values():
-            q = self.session.query(cls).order_by(cls.id)
-
-            for row in q.yield_per(5):
-                row_key = dict(table=unicode(cls.__tablename__),
-                               row_id=unicode(row.id))
-
-                def add(name, language, iso639, iso3166):
-                    normalized_name = self.normalize_name(name)
-
-                    writer.add_document(
-                        name=normalized_name, display_name=name,
-                        language=language, iso639=iso639, iso3166=iso3166,
-                        **row_key
-                    )
-
-                if cls == tables.PokemonForm:
-                    name_map = 'pokemon_name_map'
-                else:
-                    name_map = 'name_map'
-
-                for language, name in getattr(row, name_map, {}).items():
-                    if not name:
-                        continue
-
-                    add(name, language.identifier,
-                              language.iso639,
-                              language.iso3166)
-
-                    # Add generated Roomaji too
-                    # XXX this should be a first-class concept, not
-                    # piggybacking on Japanese
-                    if language.identifier == 'ja':
-                        add(romanize(name), language.identifier, language.iso639, language.iso3166)
-
-        writer.commit()
+            with profile.table(cls.__tablename__) as timing:
+                q = self.session.query(cls).order_by(cls.id)
+
+                for row in q.yield_per(5):
+                    row_key = dict(table=unicode(cls.__tablename__),
+                                   row_id=unicode(row.id))
+
+                    def add(name, language, iso639, iso3166):
+                        normalized_name = self.normalize_name(name)
+
+                        timing.rows += 1
+                        writer.add_document(
+                            name=normalized_name, display_name=name,
+                            language=language, iso639=iso639, iso3166=iso3166,
+                            **row_key
+                        )
+
+                    if cls == tables.PokemonForm:
+                        name_map = 'pokemon_name_map'
+                    else:
+                        name_map = 'name_map'
+
+                    for language, name in getattr(row, name_map, {}).items():
+                        if not name:
+                            continue
+
+                        add(name, language.identifier,
+                                  language.iso639,
+                                  language.iso3166)
+
+                        # Add generated Roomaji too
+                        # XXX this should be a first-class concept, not
+                        # piggybacking on Japanese
+                        if language.identifier == 'ja':
+                            add(romanize(name), language.identifier, language.iso639, language.iso3166)
+
+        with profile.table('(commit)') as timing:
+            writer.commit()
+            timing.commits += 1
 
 
     def normalize_name(self, name):
@@ -3,10 +3,8 @@ from optparse import OptionParser
 import os
 import sys
 
-import pokedex.db
-import pokedex.db.load
-import pokedex.db.tables
-import pokedex.lookup
+# Only the basics here: the rest of pokedex (the schema, SQLAlchemy, whoosh...)
+# takes a while to import, so each command imports what it uses
 from pokedex import defaults
 
 def main():
@@ -22,7 +20,7 @@ def main():
     args = [_.decode(enc) for _ in args]
 
     # Find the command as a function in this file
-    func = globals().get("command_%s" % command, None)
+    func = globals().get("command_%s" % command.replace('-', '_'), None)
     if func:
         func(*args)
     else:
@@ -45,6 +43,7 @@ def get_session(options):
     """Given a parsed options object, connects to the database and returns a
     session.
     """
+    import pokedex.db
 
     engine_uri = options.engine_uri
     got_from = 'command line'
@@ -60,10 +59,11 @@ def get_session(options):
 
     return session
 
-def get_lookup(options, session=None, recreate=False):
+def get_lookup(options, session=None, recreate=False, profile=None):
     """Given a parsed options object, opens the whoosh index and returns a
     PokedexLookup object.
     """
+    import pokedex.lookup
 
     if recreate and not session:
         raise ValueError("get_lookup() needs an explicit session to regen the index")
@@ -81,10 +81,42 @@ def get_lookup(options, session=None, recreate=False):
     lookup = pokedex.lookup.PokedexLookup(index_dir, session=session)
 
     if recreate:
-        lookup.rebuild_index()
+        lookup.rebuild_index(profile=profile)
 
     return lookup
 
+def get_sqlite_path(parser, session):
+    """Returns the path of the SQLite database file the session is connected
+    to, or bails out with a parser error if it isn't connected to one.
+    """
+    url = session.bind.url
+    if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+        parser.error("This option needs a SQLite database file")
+    return url.database
+
+def get_profile(options, command):
+    """Returns a Profile to time the command with if --profile was given, or
+    None otherwise.
+    """
+    import pokedex.timing
+
+    if options.profile is None:
+        return None
+    return pokedex.timing.Profile(command)
+
+def write_profile(options, profile):
+    """Writes the profile as JSON to the --profile file, and prints it as a
+    table.
+    """
+    if profile is None:
+        return
+
+    profile.write_json(options.profile)
+    print
+    print profile.format_table()
+    print
+    print "Wrote timings to %s" % options.profile
+
 def get_csv_directory(options):
     """Prints and returns the csv directory we're about to use."""
 
@@ -106,11 +138,17 @@ def get_csv_directory(options):
 ### Plumbing commands
 
 def command_dump(*args):
+    import pokedex.db.load
+
     parser = get_parser(verbose=True)
     parser.add_option('-d', '--directory', dest='directory', default=None)
     parser.add_option('-l', '--langs', dest='langs', default='en',
         help="Comma-separated list of languages to dump all strings for. "
             "Default is English ('en')")
+    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int',
+        help="Number of tables to dump at once.")
+    parser.add_option('--profile', dest='profile', default=None, metavar='FILE',
+        help="Write per-table timings to FILE, as JSON.")
     options, tables = parser.parse_args(list(args))
 
     session = get_session(options)
@@ -118,12 +156,18 @@ def command_dump(*args):
 
     langs = [l.strip() for l in options.langs.split(',')]
 
+    profile = get_profile(options, 'dump')
     pokedex.db.load.dump(session, directory=options.directory,
                                   tables=tables,
                                   verbose=options.verbose,
-                                  langs=langs)
+                                  langs=langs,
+                                  profile=profile,
+                                  jobs=options.jobs)
+    write_profile(options, profile)
 
 def command_load(*args):
+    import pokedex.db.load
+
     parser = get_parser(verbose=True)
     parser.add_option('-d', '--directory', dest='directory', default=None)
     parser.add_option('-D', '--drop-tables', dest='drop_tables', default=False, action='store_true')
@@ -133,8 +177,25 @@ def command_load(*args):
     parser.add_option('-l', '--langs', dest='langs', default=None,
         help="Comma-separated list of extra languages to load, or 'none' for none. "
             "Default is to load 'em all. Example: 'fr,de'")
+    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int',
+        help="Number of tables to load at once.")
+    parser.add_option('--incremental', dest='incremental', default=False, action='store_true',
+        help="Only reload tables whose CSV files changed since the last load.")
+    parser.add_option('--in-memory', dest='in_memory', default=False, action='store_true',
+        help="Build the whole SQLite database in memory, then write it out.")
+    parser.add_option('--batch-size', dest='batch_size', type='int',
+        default=defaults.default_batch_size,
+        help="Number of rows to insert at a time.")
+    parser.add_option('--profile', dest='profile', default=None, metavar='FILE',
+        help="Write per-table timings to FILE, as JSON.")
     options, tables = parser.parse_args(list(args))
 
+    if options.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    if options.in_memory and (tables or options.incremental):
+        parser.error("--in-memory always rebuilds the whole database")
+
     if not options.engine_uri:
         print "WARNING: You're reloading the default database, but not the lookup index.  They"
         print "         might get out of sync, and pokedex commands may not work correctly!"
@@ -152,42 +213,148 @@ def command_load(*args):
     session = get_session(options)
     get_csv_directory(options)
 
-    pokedex.db.load.load(session, directory=options.directory,
-                                  drop_tables=options.drop_tables,
-                                  tables=tables,
-                                  verbose=options.verbose,
-                                  safe=options.safe,
-                                  recursive=options.recursive,
-                                  langs=langs)
+    profile = get_profile(options, 'load')
+    if options.in_memory:
+        pokedex.db.load.load_via_memory(get_sqlite_path(parser, session),
+                                        directory=options.directory,
+                                        verbose=options.verbose,
+                                        langs=langs,
+                                        jobs=options.jobs,
+                                        batch_size=options.batch_size,
+                                        profile=profile)
+    else:
+        pokedex.db.load.load(session, directory=options.directory,
+                                      drop_tables=options.drop_tables,
+                                      tables=tables,
+                                      verbose=options.verbose,
+                                      safe=options.safe,
+                                      recursive=options.recursive,
+                                      langs=langs,
+                                      jobs=options.jobs,
+                                      incremental=options.incremental,
+                                      batch_size=options.batch_size,
+                                      profile=profile)
+    write_profile(options, profile)
+
+def command_validate(*args):
+    import pokedex.db.validate
+
+    parser = get_parser(verbose=True)
+    parser.add_option('-d', '--directory', dest='directory', default=None)
+    parser.add_option('-j', '--jobs', dest='jobs', default=None, type='int',
+        help="Number of tables to check at once.  Default is one per CPU.")
+    options, tables = parser.parse_args(list(args))
+
+    get_csv_directory(options)
+
+    problems = pokedex.db.validate.validate(tables=tables,
+                                            directory=options.directory,
+                                            verbose=options.verbose,
+                                            jobs=options.jobs)
+
+    if problems:
+        print
+        for problem in problems:
+            print problem
+        sys.exit(1)
+
+    print "All CSV files are valid."
 
 def command_reindex(*args):
     parser = get_parser(verbose=True)
+    parser.add_option('--profile', dest='profile', default=None, metavar='FILE',
+        help="Write per-table timings to FILE, as JSON.")
     options, _ = parser.parse_args(list(args))
 
     session = get_session(options)
-    lookup = get_lookup(options, session=session, recreate=True)
+    profile = get_profile(options, 'reindex')
+    lookup = get_lookup(options, session=session, recreate=True,
+                        profile=profile)
 
     print "Recreated lookup index."
+    write_profile(options, profile)
 
 
 def command_setup(*args):
+    import pokedex.db.load
+    import pokedex.snapshot
+
     parser = get_parser(verbose=False)
+    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int',
+        help="Number of tables to load at once.")
+    parser.add_option('--incremental', dest='incremental', default=False, action='store_true',
+        help="Only reload tables whose CSV files changed since the last load.")
+    parser.add_option('--in-memory', dest='in_memory', default=False, action='store_true',
+        help="Build the whole SQLite database in memory, then write it out.")
+    parser.add_option('--from-snapshot', dest='snapshot', default=None,
+        help="Install a snapshot made by build-snapshot instead of loading CSVs.")
     options, _ = parser.parse_args(list(args))
 
+    if options.in_memory and options.incremental:
+        parser.error("--in-memory always rebuilds the whole database")
+    if options.snapshot and (options.in_memory or options.incremental):
+        parser.error("--from-snapshot doesn't load anything itself")
+
     options.directory = None
 
     session = get_session(options)
     get_csv_directory(options)
-    pokedex.db.load.load(session, directory=None, drop_tables=True,
-                                  verbose=options.verbose,
-                                  safe=False)
+    if options.snapshot:
+        database_path = get_sqlite_path(parser, session)
+        index_dir = options.index_dir
+        if index_dir is None:
+            index_dir = defaults.get_default_index_dir()
+        session.close()
+        session.bind.dispose()
+
+        try:
+            pokedex.snapshot.install_snapshot(options.snapshot,
+                database_path, index_dir)
+        except pokedex.snapshot.SnapshotError, e:
+            parser.error(str(e))
+
+        print "Installed snapshot %s." % options.snapshot
+        return
+    elif options.in_memory:
+        pokedex.db.load.load_via_memory(get_sqlite_path(parser, session),
+                                        directory=None,
+                                        verbose=options.verbose,
+                                        jobs=options.jobs)
+    else:
+        pokedex.db.load.load(session, directory=None, drop_tables=True,
+                                      verbose=options.verbose,
+                                      safe=False,
+                                      jobs=options.jobs,
+                                      incremental=options.incremental)
 
     lookup = get_lookup(options, session=session, recreate=True)
 
     print "Recreated lookup index."
 
 
+def command_build_snapshot(*args):
+    import pokedex.snapshot
+
+    parser = get_parser(verbose=True)
+    parser.add_option('-d', '--directory', dest='directory', default=None)
+    parser.add_option('-o', '--output', dest='output', default=None)
+    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int',
+        help="Number of tables to load at once.")
+    options, _ = parser.parse_args(list(args))
+
+    get_csv_directory(options)
+
+    filename = pokedex.snapshot.build_snapshot(options.output,
+        directory=options.directory,
+        verbose=options.verbose,
+        jobs=options.jobs)
+
+    print "Wrote snapshot %s." % filename
+
+
 def command_status(*args):
+    import pokedex.db.tables
+
     parser = get_parser(verbose=True)
     options, _ = parser.parse_args(list(args))
     options.verbose = True
@@ -195,6 +362,8 @@ def command_status(*args):
 
     # Database, and a lame check for whether it's been inited at least once
     session = get_session(options)
+    # connect() doesn't actually connect until it has to
+    session.connection()
     print "  - OK!  Connected successfully."
 
     if pokedex.db.tables.Pokemon.__table__.exists(session.bind):
@@ -261,7 +430,7 @@ def command_lookup(*args):
 
 
 def command_help():
-    print u"""pokedex -- a command-line Pokédex interface
+    print (u"""pokedex -- a command-line Pokédex interface
 usage: pokedex {command} [options...]
 Run `pokedex setup` first, or nothing will work!
 See http://bugs.veekun.com/projects/pokedex/wiki/CLI for more documentation.
@@ -273,8 +442,12 @@ Commands:
 System commands:
     load                Load Pokédex data into a database from CSV files.
     dump                Dump Pokédex data from a database into CSV files.
+    validate            Check the CSV files against the schema, without
+                        loading them.
     reindex             Rebuilds the lookup index from the database.
     setup               Combines load and reindex.
+    build-snapshot      Builds a database and lookup index from CSV files, and
+                        bundles them up for `setup --from-snapshot`.
     status              No effect, but prints which engine, index, and csv
                         directory would be used for other commands.
 
@@ -293,9 +466,12 @@ Global options:
                         commands, except setup.
 
 System options:
-    -d|--directory=DIR  By default, load and dump will use the CSV files in the
-                        pokedex install directory.  Use this option to specify
-                        a different directory.
+    -d|--directory=DIR  By default, load, dump and validate use the CSV files
+                        in the pokedex install directory.  Use this option to
+                        specify a different directory.  Load and validate can
+                        also read the CSV files from a zip file or
+                        (compressed) tarball, or from a directory of gzipped
+                        .csv.gz files.
 
 Load options:
     -D|--drop-tables    Drop all tables before loading data.
@@ -304,15 +480,54 @@ Load options:
     -l|--langs          Load translations for the given languages.
                         By default, all available translations are loaded.
                         Separate multiple languages by a comma (-l en,de,fr)
+    -j|--jobs=N         Load up to N independent tables at once.  Also
+                        accepted by setup.
+    --incremental       Only reload tables whose CSV files changed since they
+                        were last loaded, plus the tables depending on them.
+                        Also accepted by setup.
+    --in-memory         Build the whole SQLite database in memory, then write
+                        it to the database file in one go.  Also accepted by
+                        setup.
+    --batch-size=N      Insert (and commit) N rows at a time.  The default is
+                        %(batch_size)d.
+
+Validate options:
+    -j|--jobs=N         Check up to N tables at once.  The default is one per
+                        CPU.
+
+    Validate checks every value's type, length and nullability, that primary
+    keys are unique and that foreign keys refer to existing rows.  It exits
+    with status 1 if there are any problems.
+
+Setup options:
+    --from-snapshot=FILE
+                        Install the database and lookup index from a snapshot
+                        made by build-snapshot.  The snapshot must have been
+                        built from the current CSV files.
+
+Build-snapshot options:
+    -o|--output=FILE    Write the snapshot here.  By default, it is named after
+                        the hash of the CSV files, in the current directory.
+    -j|--jobs=N         As for load.
 
 Dump options:
     -l|--langs          Dump unofficial texts for given languages.
                         By default, English (en) is dumped.
                         Separate multiple languages by a comma (-l en,de,fr)
                         Use 'none' to not dump any unofficial texts.
+    -j|--jobs=N         Dump up to N tables at once.
+
+    Dump only rewrites CSV files whose contents changed.
+
+Profiling options:
+    --profile=FILE      Time every table: wall time, time spent on each part
+                        of the work, commits, rows, bytes and peak memory use.
+                        The timings are written to FILE as JSON, and printed
+                        as a table, slowest first.  Accepted by load, dump and
+                        reindex.
 
-    Additionally, load and dump accept a list of table names (possibly with
-    wildcards) and/or csv fileames as an argument list.
-""".encode(sys.getdefaultencoding(), 'replace')
+    Additionally, load, dump and validate accept a list of table names
+    (possibly with wildcards) and/or csv fileames as an argument list.
+""" % dict(batch_size=defaults.default_batch_size)).encode(sys.getdefaultencoding(), 'replace')
 
     sys.exit(0)
@@ -0,0 +1,174 @@
+"""Prebuilt snapshots of the SQLite database and lookup index.
+
+A snapshot is a gzipped tarball holding a SQLite database, the whoosh lookup
+index built from it, and a `snapshot.json` file.  That file records the hash of
+the CSV data the snapshot was built from (see
+`pokedex.db.load.csv_manifest_hash`) and a SHA-256 checksum of every other file
+in the tarball.  Installing a snapshot is then just a matter of checking it and
+unpacking it, instead of loading all the CSV files and indexing everything.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+
+import pokedex.db
+import pokedex.db.load
+import pokedex.lookup
+
+__all__ = ['SnapshotError', 'build_snapshot', 'install_snapshot']
+
+SNAPSHOT_FORMAT = 1
+
+_manifest_name = 'snapshot.json'
+_database_name = 'pokedex.sqlite'
+_index_name = 'whoosh-index'
+
+class SnapshotError(Exception):
+    pass
+
+def _sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def default_snapshot_filename(csv_hash):
+    return 'pokedex-snapshot-%s.tar.gz' % csv_hash[:12]
+
+def build_snapshot(filename=None, directory=None, verbose=False, jobs=1):
+    """Builds a snapshot from the CSV files in `directory` (by default, the
+    pokedex data directory).  Returns the snapshot's filename.
+
+    `filename` defaults to a name based on the hash of the CSV data, in the
+    current directory.
+    """
+    csv_hash = pokedex.db.load.csv_manifest_hash(directory)
+    if filename is None:
+        filename = default_snapshot_filename(csv_hash)
+
+    workdir = tempfile.mkdtemp(prefix='pokedex-snapshot-')
+    try:
+        database_path = os.path.join(workdir, _database_name)
+        pokedex.db.load.load_via_memory(database_path, directory=directory,
+            verbose=verbose, jobs=jobs)
+
+        session = pokedex.db.connect('sqlite:///' + database_path)
+        lookup = pokedex.lookup.PokedexLookup(
+            os.path.join(workdir, _index_name), session=session)
+        lookup.rebuild_index()
+        session.close()
+        session.bind.dispose()
+
+        members = [_database_name]
+        for index_file in sorted(os.listdir(os.path.join(workdir, _index_name))):
+            members.append('%s/%s' % (_index_name, index_file))
+
+        manifest = dict(
+            format=SNAPSHOT_FORMAT,
+            csv_hash=csv_hash,
+            files=dict((member, _sha256(os.path.join(workdir, member)))
+                for member in members),
+        )
+        with open(os.path.join(workdir, _manifest_name), 'wb') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+        # Write to a temporary name first, so a half-written snapshot never
+        # shows up under the real one
+        temp_filename = filename + '.tmp'
+        tar = tarfile.open(temp_filename, 'w:gz')
+        try:
+            for member in [_manifest_name] + members:
+                tar.add(os.path.join(workdir, member), arcname=member)
+        finally:
+            tar.close()
+        os.rename(temp_filename, filename)
+    finally:
+        shutil.rmtree(workdir)
+
+    return filename
+
+def install_snapshot(filename, database_path, index_dir, directory=None,
+                     check_csv=True):
+    """Checks the snapshot in `filename`, then puts its database at
+    `database_path` and its lookup index in `index_dir`.
+
+    Unless `check_csv` is false, the snapshot must have been built from the
+    same CSV data as is in `directory` (by default, the pokedex data
+    directory).
+
+    Raises SnapshotError if anything doesn't add up; nothing is touched then.
+    """
+    try:
+        tar = tarfile.open(filename, 'r:gz')
+    except (IOError, tarfile.TarError), e:
+        raise SnapshotError("Can't open snapshot %s: %s" % (filename, e))
+
+    try:
+        try:
+            manifest = json.load(tar.extractfile(_manifest_name))
+        except (KeyError, ValueError):
+            raise SnapshotError("%s is not a pokedex snapshot" % filename)
+
+        if manifest.get('format') != SNAPSHOT_FORMAT:
+            raise SnapshotError("Unknown snapshot format: %s" % manifest.get('format'))
+
+        if check_csv:
+            csv_hash = pokedex.db.load.csv_manifest_hash(directory)
+            if manifest['csv_hash'] != csv_hash:
+                raise SnapshotError(
+                    "Snapshot was built from different CSV data "
+                    "(%s, but the CSV files are at %s)" % (
+                        manifest['csv_hash'][:12], csv_hash[:12]))
+
+        # Only ever extract the files the manifest lists, and nothing that
+        # could end up outside our temporary directory
+        files = manifest['files']
+        for member in files:
+            if (member != _database_name and
+                    not re.match(r'^%s/[^/]+$' % _index_name, member)) or '..' in member:
+                raise SnapshotError("Unexpected file in snapshot: %s" % member)
+        if _database_name not in files:
+            raise SnapshotError("Snapshot has no database")
+
+        # Unpack next to the database, so it can be renamed into place
+        workdir = tempfile.mkdtemp(prefix='.pokedex-snapshot-',
+            dir=os.path.dirname(os.path.abspath(database_path)))
+        try:
+            os.mkdir(os.path.join(workdir, _index_name))
+            for member, checksum in files.items():
+                try:
+                    source = tar.extractfile(member)
+                except KeyError:
+                    source = None
+                if source is None:
+                    raise SnapshotError("Snapshot is missing %s" % member)
+                path = os.path.join(workdir, member)
+                with open(path, 'wb') as f:
+                    shutil.copyfileobj(source, f)
+                if _sha256(path) != checksum:
+                    raise SnapshotError("Checksum mismatch for %s" % member)
+
+            # Everything checks out; move it all into place
+            os.rename(os.path.join(workdir, _database_name), database_path)
+
+            if os.path.exists(index_dir):
+                # Same care as PokedexLookup.rebuild_index takes
+                for f in os.listdir(index_dir):
+                    if re.match('^_?(MAIN|SPELL)_', f):
+                        os.remove(os.path.join(index_dir, f))
+            else:
+                os.mkdir(index_dir)
+            for f in os.listdir(os.path.join(workdir, _index_name)):
+                shutil.move(os.path.join(workdir, _index_name, f),
+                    os.path.join(index_dir, f))
+        finally:
+            shutil.rmtree(workdir)
+    finally:
+        tar.close()
+
+    return manifest
@@ -1,10 +1,11 @@
 
 import pytest
 
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import aliased, joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
-from pokedex.db import connect, tables, util
+from pokedex.db import connect, tables, util, verify
 
 def test_encounter_slots():
     # Encounters have a version, which has a version group; encounters also
@@ -64,3 +65,29 @@ def test_unique_form_order():
                         form.order,
                         species_by_form_order[form.order].name,
                         form.species.name))
+
+def test_foreign_keys():
+    # Every foreign key in the database refers to an existing row
+    session = connect()
+    assert verify.verify(session) == []
+
+def test_pooled_request_sessions():
+    session = connect(pool=dict(size=2, max_overflow=0, pre_ping=True))
+    with session.request_session(default_language_id=1) as request_session:
+        assert request_session.default_language_id == 1
+        assert request_session.query(tables.Language).get(1).id == 1
+    # The next session starts over in English
+    assert session.default_language_id == 9
+
+def test_readonly():
+    session = connect(readonly=True)
+    assert session.query(tables.Language).get(9).identifier == u'en'
+    with pytest.raises(OperationalError):
+        session.execute(tables.Language.__table__.delete())
+    session.rollback()
+
+def test_readonly_missing_file(tmpdir):
+    path = tmpdir.join('missing.sqlite')
+    with pytest.raises(IOError):
+        connect('sqlite:///' + str(path), readonly=True)
+    assert not path.check()
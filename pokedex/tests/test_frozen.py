@@ -0,0 +1,55 @@
+import cPickle as pickle
+
+import pytest
+
+from pokedex.db import connect, frozen, tables
+
+session = connect()
+
+@pytest.fixture(scope='module')
+def dex():
+    # Freezing takes a while; only do it if a test here actually runs
+    return frozen.freeze(session)
+
+def test_matches_orm(dex):
+    species = session.query(tables.PokemonSpecies).filter_by(identifier=u'bulbasaur').one()
+    record = dex.get(tables.PokemonSpecies, identifier=u'bulbasaur')
+    assert isinstance(record, frozen.PokemonSpecies)
+    assert record.id == species.id
+    assert record.name == species.name
+    assert [p.id for p in record.pokemon] == [p.id for p in species.pokemon]
+    pokemon = record.pokemon[0]
+    assert pokemon.species is record
+    assert [t.name for t in pokemon.types] == [t.name for t in species.pokemon[0].types]
+    assert [f.id for f in pokemon.forms] == [f.id for f in species.pokemon[0].forms]
+    assert pokemon.default_form.id == species.pokemon[0].default_form.id
+    assert pokemon.forms[0].species is record
+
+def test_move_type(dex):
+    move = dex.get(frozen.Move, identifier=u'surf')
+    assert move.type is dex.get(tables.Type, identifier=u'water')
+
+def test_proxies_through_relationships(dex):
+    item = session.query(tables.Item).filter_by(identifier=u'potion').one()
+    assert dex.get(frozen.Item, identifier=u'potion').pocket.id == item.pocket.id
+    version = session.query(tables.Version).filter_by(identifier=u'red').one()
+    assert (dex.get(frozen.Version, identifier=u'red').generation.id ==
+        version.generation.id)
+
+def test_get(dex):
+    assert dex.get(tables.Pokemon, id=1) is dex.all(tables.Pokemon)[0]
+    with pytest.raises(KeyError):
+        dex.get(tables.Pokemon, identifier=u'missingno')
+
+def test_read_only(dex):
+    record = dex.get(tables.Pokemon, id=1)
+    with pytest.raises(AttributeError):
+        record.height = 100
+    with pytest.raises(AttributeError):
+        del record.height
+
+def test_pickle(dex):
+    copy = pickle.loads(pickle.dumps(dex, pickle.HIGHEST_PROTOCOL))
+    record = copy.get(tables.PokemonSpecies, identifier=u'bulbasaur')
+    assert record.name == dex.get(tables.PokemonSpecies, id=1).name
+    assert record.pokemon[0].species is record
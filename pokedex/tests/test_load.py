@@ -0,0 +1,83 @@
+import io
+import shutil
+import threading
+
+import pytest
+
+from pokedex.db import connect, load, metadata, tables
+from pokedex.db.dependencies import group_into_levels
+from pokedex.defaults import get_default_csv_dir
+
+def test_dependency_levels():
+    # Every table only depends on tables in earlier levels
+    levels = group_into_levels(metadata.tables.values())
+    assert sum(len(level) for level in levels) == len(metadata.tables)
+    loaded = set()
+    for level in levels:
+        for table in level:
+            for fk in table.foreign_keys:
+                referred = fk.column.table
+                assert referred is table or referred in loaded, (
+                    "%s needs %s" % (table.name, referred.name))
+        loaded.update(level)
+
+def test_sort_self_referencing():
+    # (id, parent_id): 1 <- 3 <- 2 <- 4, plus a row pointing at itself and a
+    # row pointing outside the table
+    rows = [(4, 2), (2, 3), (3, 1), (1, None), (5, 5), (6, 100)]
+    sorted_rows = load._sort_self_referencing(rows, 0, [1])
+    assert sorted(sorted_rows) == sorted(rows)
+    position = dict((row[0], n) for n, row in enumerate(sorted_rows))
+    for id, parent_id in rows:
+        if parent_id in position and parent_id != id:
+            assert position[parent_id] < position[id]
+
+def test_sort_self_referencing_cycle():
+    with pytest.raises(ValueError):
+        load._sort_self_referencing([(1, 2), (2, 1), (3, None)], 0, [1])
+
+def test_prefetch_stops_when_closed():
+    produced = []
+    def numbers():
+        for n in xrange(1000):
+            produced.append(n)
+            yield n
+    threads = threading.active_count()
+    items = load._prefetch(numbers(), size=2)
+    assert next(items) == 0
+    items.close()
+    # The producer was stuck on the full queue; it must have quit
+    assert len(produced) < 1000
+    assert threading.active_count() == threads
+
+def test_load_subset(tmpdir):
+    # pokemon_color_names refers to languages, which isn't loaded
+    session = connect('sqlite:///' + str(tmpdir.join('subset.sqlite')))
+    load.load(session, tables=['pokemon_color_names'], recursive=False)
+    assert session.query(tables.PokemonColor.names_table).count() > 0
+
+def test_load_orphans(tmpdir, capsys):
+    root = tmpdir.mkdir('csv')
+    shutil.copy(get_default_csv_dir() + '/languages.csv', str(root))
+    root.join('pokemon_colors.csv').write('id,identifier\n1,black\n')
+    root.join('pokemon_color_names.csv').write(
+        'pokemon_color_id,local_language_id,name\n1,9,Black\n2,9,Blue\n')
+    session = connect('sqlite:///' + str(tmpdir.join('orphans.sqlite')))
+    orphans = load.load(session,
+        tables=['pokemon_colors', 'pokemon_color_names'],
+        directory=str(root), recursive=False)
+    assert orphans == [(
+        'pokemon_color_names.pokemon_color_id -> pokemon_colors.id', 1)]
+    # Not verbose, so nothing is printed
+    assert capsys.readouterr()[0] == ''
+
+def test_record_counter():
+    contents = 'id,text\n1,"two\nlines"\n2,"a ""quoted""\nvalue"\n3,last'
+    for size in (1, 2, 5, 100):
+        counter = load._RecordCounter(io.BytesIO(contents))
+        while counter.read(size):
+            pass
+        assert counter.records == 4
+    counter = load._RecordCounter(io.BytesIO(contents + '\n'))
+    counter.read()
+    assert counter.records == 4
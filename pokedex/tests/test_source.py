@@ -0,0 +1,70 @@
+import gzip
+import tarfile
+import zipfile
+
+import pytest
+
+from pokedex.db.source import (
+    open_source, DirectorySource, TarSource, ZipSource)
+
+files = {
+    'languages.csv': 'id,identifier\n1,en\n',
+    'pokemon.csv': 'id,identifier\n1,bulbasaur\n',
+    'translations/cs.csv': 'language_id,table,id,column,source_crc,string\n',
+}
+
+def make_directory(tmpdir, compress=False):
+    root = tmpdir.mkdir('csv')
+    root.mkdir('translations')
+    for name, contents in files.items():
+        path = str(root.join(name))
+        if compress:
+            f = gzip.open(path + '.gz', 'wb')
+        else:
+            f = open(path, 'wb')
+        f.write(contents)
+        f.close()
+    return str(root)
+
+def make_zip(tmpdir):
+    path = str(tmpdir.join('csv.zip'))
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    for name, contents in files.items():
+        archive.writestr('data/' + name, contents)
+    archive.close()
+    return path
+
+def make_tarball(tmpdir):
+    path = str(tmpdir.join('csv.tar.gz'))
+    archive = tarfile.open(path, 'w:gz')
+    archive.add(make_directory(tmpdir), 'pokedex-csv')
+    archive.close()
+    return path
+
+@pytest.mark.parametrize(('make_source', 'source_class'), [
+    (make_directory, DirectorySource),
+    (lambda tmpdir: make_directory(tmpdir, compress=True), DirectorySource),
+    (make_zip, ZipSource),
+    (make_tarball, TarSource),
+])
+def test_source(tmpdir, make_source, source_class):
+    source = open_source(make_source(tmpdir))
+    assert isinstance(source, source_class)
+
+    for name, contents in files.items():
+        assert source.open(name).read() == contents
+        assert source.size(name) == len(contents)
+    assert list(source.open('pokemon.csv')) == ['id,identifier\n', '1,bulbasaur\n']
+
+    assert source.listdir('translations') == ['cs.csv']
+    assert 'pokemon.csv' in source.listdir()
+
+    with pytest.raises(IOError):
+        source.open('moves.csv')
+    assert source.size('moves.csv') is None
+
+def test_not_a_source(tmpdir):
+    path = tmpdir.join('junk.txt')
+    path.write('junk')
+    with pytest.raises(IOError):
+        open_source(str(path))
@@ -5,7 +5,7 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from pokedex.tests import positional_params
 
-from pokedex.db import tables, connect, util, markdown
+from pokedex.db import tables, connect, util, markdown, multilang
 
 connection = connect()
 
@@ -167,3 +167,15 @@ def test_markdown_values(parent_class, translation_class, column_name):
             error_message = error_message.format(key, text)
 
             assert not any(char in text for char in '[]{}'), error_message
+
+def test_preload_names():
+    species = connection.query(tables.PokemonSpecies).order_by(
+            tables.PokemonSpecies.id).limit(20).all()
+    multilang.preload_names(connection, species, all_languages=True)
+    for obj in species:
+        assert 'names_local' in obj.__dict__
+        assert 'names' in obj.__dict__
+    assert species[0].name == u'Bulbasaur'
+    japanese = connection.query(tables.Language).filter_by(
+            identifier=u'ja').one()
+    assert species[0].name_map[japanese] == u'フシギダネ'
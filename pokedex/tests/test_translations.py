@@ -1,6 +1,7 @@
 # Encoding: UTF-8
 
 import csv
+import itertools
 
 import pytest
 
@@ -148,6 +149,15 @@ def test_merge_dynamic_add():
     merge.add_iterator(adder())
     assert tuple(merge) == (1, 1, 2, 2, 3, 3, 4, 4, 4)
 
+def test_merge_key():
+    merged = translations.Merge((3, 2, 1), (4, 0), key=lambda x: -x)
+    assert list(merged) == [4, 3, 2, 1, 0]
+
+def test_merge_messages():
+    messages = get_messages(*fake_translation_csv[1:])
+    merged = list(translations.Merge(messages[::2], messages[1::2]))
+    assert [m.sort_key for m in merged] == sorted(m.sort_key for m in messages)
+
 def test_merge_adjacent():
     messages = get_messages(
             '0,Table,1,col,,strA',
@@ -161,6 +171,43 @@ def test_merge_adjacent():
     expected = ['strA', 'strB\n\nstrC\n\nstrD', 'strE']
     assert result == expected
 
+def test_message_strings():
+    first, same, other = get_messages(
+            '0,Table,1,col,,str',
+            '0,Table,1,col,,str',
+            '0,Table,1,col,,other',
+        )
+    assert first.strings == ('str',)
+    assert first.string == 'str'
+    assert first == same and first != other
+    assert hash(first.eq_key) == hash(same.eq_key)
+    assert len(set(m.eq_key for m in (first, same, other))) == 2
+    # Names read from CSV are interned, so they're shared, not copied
+    assert first.cls is same.cls is intern('Table')
+    assert first.colname is other.colname is intern('col')
+    assert translations.Message.from_row(first.row) == first
+
+    first.merge(same)
+    first.merge(other)
+    assert first.strings == ('str', 'other')
+    assert first.string == 'str\n\nother'
+    assert same.strings == ('str',)
+
+def test_merge_adjacent_source():
+    # Merging gives each object's strings in order, without repeats
+    messages = sorted(translations.Translations().yield_source_messages())
+    expected = []
+    for key, group in itertools.groupby(messages, lambda m: m.merge_key):
+        strings = []
+        for message in group:
+            strings.extend(s for s in message.strings if s not in strings)
+        expected.append((key, tuple(strings)))
+    # merge() changes the messages, so read them again
+    messages = sorted(translations.Translations().yield_source_messages())
+    result = [(m.merge_key, m.strings)
+        for m in translations.merge_adjacent(messages)]
+    assert result == expected
+
 def test_leftjoin():
     check_leftjoin([], [], [], [])
     check_leftjoin([], [1], [], [1])
@@ -181,3 +228,24 @@ def check_leftjoin(seqa, seqb, expected, expected_unused):
     result = list(translations.leftjoin(seqa, seqb, unused=unused.append))
     assert result == list(expected)
     assert unused == list(expected_unused)
+
+def test_get_load_data():
+    transl = translations.Translations()
+    assert list(transl.get_load_data([])) == []
+    keys = set()
+    for translation_class, rows in transl.get_load_data(['cs'], batch_size=50):
+        assert 0 < len(rows) <= 50
+        id_column = translation_class.__table__.c.keys()[0]
+        for row in rows:
+            assert row['local_language_id'] == transl.language_ids['cs']
+            key = translation_class, row[id_column]
+            assert key not in keys
+            keys.add(key)
+    assert keys
+
+def test_yield_source_messages_jobs():
+    transl = translations.Translations()
+    serial = transl.yield_source_messages()
+    parallel = transl.yield_source_messages(jobs=2)
+    for expected, message in itertools.izip_longest(serial, parallel):
+        assert message.row == expected.row
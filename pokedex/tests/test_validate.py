@@ -0,0 +1,59 @@
+import shutil
+
+from pokedex.db import tables
+from pokedex.db.source import DirectorySource
+from pokedex.db.validate import validate, _validate_table
+from pokedex.defaults import get_default_csv_dir
+
+def make_directory(tmpdir, files):
+    root = tmpdir.mkdir('csv')
+    shutil.copy(get_default_csv_dir() + '/languages.csv', str(root))
+    for name, contents in files.items():
+        root.join(name).write(contents)
+    return str(root)
+
+def check_colors(tmpdir, contents):
+    root = make_directory(tmpdir, {'pokemon_colors.csv': contents})
+    problems, keys, references = _validate_table(
+        DirectorySource(root), tables.PokemonColor.__table__)
+    return problems
+
+def test_valid(tmpdir):
+    assert check_colors(tmpdir, 'id,identifier\n1,black\n2,blue\n') == []
+
+def test_bad_integer(tmpdir):
+    problems = check_colors(tmpdir, 'id,identifier\n1,black\nx,blue\n')
+    assert len(problems) == 1
+    assert 'line 3' in problems[0] and 'not an integer' in problems[0]
+
+def test_too_long(tmpdir):
+    problems = check_colors(tmpdir, 'id,identifier\n1,ultraviolet\n')
+    assert len(problems) == 1
+    assert '11 characters long' in problems[0]
+
+def test_duplicate_primary_key(tmpdir):
+    problems = check_colors(tmpdir, 'id,identifier\n1,black\n1,blue\n')
+    assert len(problems) == 1
+    assert 'duplicate primary key' in problems[0]
+
+def test_missing_column(tmpdir):
+    problems = check_colors(tmpdir, 'identifier\nblack\n')
+    assert problems == [
+        "pokemon_colors.csv: column id is missing, but isn't nullable"]
+
+def test_missing_non_key_column(tmpdir):
+    problems = check_colors(tmpdir, 'id\n1\n2\n')
+    assert problems == [
+        "pokemon_colors.csv: column identifier is missing, but isn't nullable"]
+
+def test_foreign_keys(tmpdir):
+    root = make_directory(tmpdir, {
+        'pokemon_colors.csv': 'id,identifier\n1,black\n',
+        'pokemon_color_names.csv':
+            'pokemon_color_id,local_language_id,name\n1,9,Black\n2,9,Blue\n',
+    })
+    problems = validate(tables=['pokemon_color_names'], directory=root,
+        jobs=1)
+    assert len(problems) == 1
+    assert 'pokemon_color_id' in problems[0]
+    assert 'not in pokemon_colors.id: 2' in problems[0]
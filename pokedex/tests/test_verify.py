@@ -0,0 +1,47 @@
+import sqlalchemy
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, Table
+from sqlalchemy.orm import Session
+
+from pokedex.db import verify
+
+def test_orphans():
+    metadata = MetaData()
+    parents = Table('parents', metadata,
+        Column('id', Integer, primary_key=True))
+    children = Table('children', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('parent_id', Integer, ForeignKey('parents.id')),
+        Column('sibling_id', Integer, ForeignKey('children.id')))
+    session = Session(bind=sqlalchemy.create_engine('sqlite://'))
+    metadata.create_all(bind=session.bind)
+    session.execute(parents.insert(), [dict(id=1), dict(id=2)])
+    session.execute(children.insert(), [
+        dict(id=1, parent_id=1, sibling_id=None),
+        dict(id=2, parent_id=3, sibling_id=1),
+        dict(id=3, parent_id=None, sibling_id=5),
+        dict(id=4, parent_id=4, sibling_id=4),
+    ])
+
+    assert verify.verify(session, [parents, children]) == [
+        ('children.parent_id -> parents.id', 2),
+        ('children.sibling_id -> children.id', 1),
+    ]
+
+def test_missing_tables():
+    metadata = MetaData()
+    parents = Table('parents', metadata,
+        Column('id', Integer, primary_key=True))
+    children = Table('children', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('parent_id', Integer, ForeignKey('parents.id')),
+        Column('sibling_id', Integer, ForeignKey('children.id')))
+    session = Session(bind=sqlalchemy.create_engine('sqlite://'))
+    children.create(bind=session.bind)
+    session.execute(children.insert(), [
+        dict(id=1, parent_id=1, sibling_id=2),
+    ])
+
+    # Only the key between existing tables can be checked
+    assert verify.verify(session, [parents, children]) == [
+        ('children.sibling_id -> children.id', 1),
+    ]
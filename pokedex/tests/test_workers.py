@@ -0,0 +1,20 @@
+import pytest
+
+from pokedex.db.workers import run_in_pool
+
+def square(n):
+    return n * n
+
+def fail(n):
+    raise ValueError(n)
+
+def test_run_in_pool():
+    assert list(run_in_pool(square, range(10), 2, ordered=True)) == [
+        n * n for n in range(10)]
+    assert sorted(run_in_pool(square, range(10), 2)) == [
+        n * n for n in range(10)]
+
+def test_run_in_pool_failure():
+    with pytest.raises(RuntimeError) as excinfo:
+        list(run_in_pool(fail, [1, 2], 2))
+    assert 'ValueError' in str(excinfo.value)
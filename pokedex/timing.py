@@ -0,0 +1,142 @@
+"""Per-table timing and throughput reports, as written by `--profile`.
+
+`load`, `dump` and `PokedexLookup.rebuild_index` accept a `Profile`, and fill
+in one `TableTiming` per table they handle.  The profile can then be written
+out as JSON, or formatted as a plain-text table sorted by wall time.
+"""
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+__all__ = ['Profile', 'TableTiming']
+
+def peak_rss():
+    """Returns the peak resident set size of this process so far, in kB, or
+    None if that can't be determined.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux, but in bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+class TableTiming(object):
+    """Numbers for one table.
+
+    `wall` is the total time spent on the table, in seconds.  `phases` maps
+    the name of each part of the work (e.g. "parse" and "insert" for load) to
+    the seconds spent on it.  `bytes` is the size of the CSV file read or
+    written.  `peak_rss` is the process's peak RSS once the table was done,
+    in kB.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.phases = {}
+        self.commits = 0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_rss = None
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        """Adds the time spent in the `with` block to the given phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            wall=self.wall,
+            phases=self.phases,
+            commits=self.commits,
+            rows=self.rows,
+            bytes=self.bytes,
+            peak_rss=self.peak_rss,
+        )
+
+class Profile(object):
+    """A collection of `TableTiming`s for one command."""
+    def __init__(self, command):
+        self.command = command
+        self.tables = []
+        self.start_time = time.time()
+
+    @contextmanager
+    def table(self, name):
+        """Times a `with` block that handles the named table, and yields its
+        `TableTiming` so the block can fill in the details.
+        """
+        timing = TableTiming(name)
+        start = time.time()
+        try:
+            yield timing
+        finally:
+            timing.wall = time.time() - start
+            timing.peak_rss = peak_rss()
+            self.tables.append(timing)
+
+    def add(self, timing):
+        """Adds a `TableTiming` made elsewhere, e.g. in a worker process."""
+        self.tables.append(timing)
+
+    def as_dict(self):
+        return dict(
+            command=self.command,
+            wall=time.time() - self.start_time,
+            peak_rss=peak_rss(),
+            tables=[timing.as_dict() for timing in self.tables],
+        )
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
+            f.write('\n')
+
+    def format_table(self):
+        """Returns the timings as a text table, slowest table first."""
+        phase_names = sorted(set(phase
+            for timing in self.tables for phase in timing.phases))
+        headers = (['table', 'wall'] + phase_names +
+            ['commits', 'rows', 'rows/s', 'bytes', 'peak kB'])
+
+        lines = []
+        for timing in sorted(self.tables, key=lambda t: (-t.wall, t.name)):
+            if timing.wall:
+                rate = '%d' % (timing.rows / timing.wall)
+            else:
+                rate = '-'
+            lines.append([timing.name, '%.3f' % timing.wall] +
+                ['%.3f' % timing.phases.get(phase, 0) for phase in phase_names] +
+                [str(timing.commits), str(timing.rows), rate,
+                 str(timing.bytes), str(timing.peak_rss or '-')])
+        lines.append(['total', '%.3f' % sum(t.wall for t in self.tables)] +
+            ['%.3f' % sum(t.phases.get(phase, 0) for t in self.tables)
+                for phase in phase_names] +
+            [str(sum(t.commits for t in self.tables)),
+             str(sum(t.rows for t in self.tables)), '',
+             str(sum(t.bytes for t in self.tables)), str(peak_rss() or '-')])
+
+        widths = [max(len(line[i]) for line in [headers] + lines)
+            for i in range(len(headers))]
+        def format_line(line):
+            # Left-align the table name, right-align the numbers
+            return '  '.join([line[0].ljust(widths[0])] +
+                [value.rjust(width) for value, width in zip(line[1:], widths[1:])])
+        return '\n'.join([format_line(headers)] +
+            [format_line(line) for line in lines])